@@ -1,7 +1,7 @@
 # == Global imports ==
-import os, os.path, sys
-from urllib.parse import urlparse
-from urllib.request import urlretrieve
+import os, os.path, sys, io, re
+from urllib.parse import urlparse, urljoin
+from urllib.request import urlopen
 from urllib.error import URLError
 from pathlib import Path
 from types import FunctionType, GeneratorType
@@ -11,15 +11,73 @@ sys.path.append('../..')
 
 from Cassiopee.parsing.exceptions import *
 from Cassiopee.parsing.validate import *
-from Cassiopee.parsing.pipes import Stream
+from Cassiopee.parsing.pipes import Stream, MappedStream
+from Cassiopee.parsing.archives import openfile, inarchive
+from Cassiopee.parsing.scanner import *
 from Cassiopee.parsing.base import *
 from Cassiopee.parsing.sgml import *
 from Cassiopee.parsing.nodes import *
+from Cassiopee.parsing.light import *
+from Cassiopee.parsing.batch import *
+from Cassiopee.parsing.index import Index
+from Cassiopee.parsing.frozen import Frozen, FrozenNode, freeze
+from Cassiopee.parsing.expat import *
 
-class Parser(Node):
+class Builder:
+    '''Build a document with the parser's own scanning.'''
 
-    def __init__(self, xmlfile=''):
-        super(Parser, self).__init__()
+    def __init__(self, parser, document):
+        self.parser = parser
+        # The last element in the list is the one to append new elements to
+        self.ancestors = [document]
+        # Scanner for fed data
+        self.stream = None
+
+    def feed(self, data, validate=False):
+        if self.stream is None:
+            self.stream = Scanner()
+        self.stream.feed(data)
+        if not self.stream.waiting:
+            self.parser.parse(self.stream, self.ancestors, validate)
+
+    def close(self, validate=False):
+        if self.stream is not None:
+            self.stream.close()
+            self.parser.parse(self.stream, self.ancestors, validate)
+
+    def parsefile(self, loc, validate=False):
+        # The source characters, scanned a chunk at a time
+        if self.ancestors[0].lazy or inarchive(loc):
+            # Lazy elements need byte offsets, and archive members are
+            # decompressed, so the source is read as bytes.
+            with openfile(loc) as file:
+                self.parser.parse(Scanner(file), self.ancestors, validate)
+        else:
+            with MappedStream(loc) as file:
+                self.parser.parse(Scanner(file), self.ancestors, validate)
+
+# Ways to build documents, by name.
+backends = {'python': Builder, 'expat': ExpatBuilder}
+
+class Parser(Document):
+    '''XML parser.
+
+    Calling it parses a file into the parser itself, which is the root of
+    the resulting tree. load() parses a file into a new Document instead,
+    so that one parser can be used by many threads at once.
+
+    The backend is either 'python', for the parser's own scanning and DTD
+    handling, or 'expat', for the faster pyexpat C parser, which does not
+    validate or read external DTDs.'''
+
+    def __init__(self, xmlfile='', backend='python'):
+        super(Parser, self).__init__(parser=self)
+        if backend not in backends:
+            raise ValueError('Unknown backend: {!r}.'.format(backend))
+        self.backend = backend
+        self.builder = backends[backend]
+        # Symbol table, shared by the names of all the parsed documents
+        self.names = Names()
         # Tag types
         self.tags = {'!': self.newdecl,
                      '?': self.newpi,
@@ -40,245 +98,319 @@ class Parser(Node):
             self.tags[char](stream, ancestors, validate)
         else:
             if validate:
-                test_name(self, char, stream, ancestors)
-                test_doctype(self, char, stream, ancestors)
+                test_name(ancestors[0], char, stream, ancestors)
+                test_doctype(ancestors[0], char, stream, ancestors)
             self.newelement(stream, char, ancestors, validate)
 
     def newattr(self, stream, ancestors, validate=False):
         # Whoa! We just collected an attribute name!
         # Let's get its value, too.
         # Support for attribute name space will have to be added.
-        for char in stream:
-            # There may be spaces here, so we just
-            # ignore them.
-            if char == '"':
-                break
-        self.newval(stream, ancestors, validate)
+        # There may be spaces before the quote, so we just ignore them.
+        stream.until(QUOTE)
+        quote = next(stream, '"')
+        self.newval(stream, ancestors, validate, quote)
 
-    def newval(self, stream, ancestors, validate=False):
-        self.newstr(stream, ancestors, validate)
+    def newval(self, stream, ancestors, validate=False, quote='"'):
+        self.newstr(stream, ancestors, validate, quote)
         data = ancestors.pop(-1)
         ancestors[-1].value(data)
 
     def newelement(self, stream, data, ancestors, validate=False):
         # Tag parsing layer.
-        # The tag may be opening an element, or
+        # Where the tag starts, for documents tracking the spans of their
+        # elements.
+        start = None
+        if ancestors[0].source is not None:
+            start = stream.tell() - len(data) - 1
+        # Most tags are read whole, in one match.
+        tag = stream.match(START_TAG)
+        if tag:
+            name, attrs, closed = tag.groups()
+            self.openelement(data + name, ancestors, stream, validate, start)
+            # The ID of the element is only indexed once it is closed, so
+            # its attributes are set without going through addattr().
+            new = ancestors[-1].attrs
+            for attr in ATTRIBUTE.finditer(attrs):
+                value = attr.group(2)
+                if value is None:
+                    value = attr.group(3)
+                key = self.names(attr.group(1))
+                new[key.text] = Attribute(key, Text(value))
+            if closed:
+                self.closeelement(ancestors[-1].name, stream, ancestors,
+                                  validate)
+            elif isinstance(ancestors[-1], LazyElement):
+                self.skipelement(stream, ancestors, validate)
+            return
+        # Otherwise, the whole name is scanned at once, along with its
+        # namespace.
+        self.openelement(data + stream.until(NAME_END), ancestors, stream,
+                         validate, start)
+        # The tag may now hold attributes, and be opening an element or
         # being autoclosed.
-        # Namespace and name for the element.
-        space, name = '', ''
-        # The element's attributes
-        # An attribute's namespace.
-        keyspace = ''
-        for char in stream:
-            if char == ':':
-                if not name:
-                    space = data
-                else:
-                    keyspace = data
-                data = ''
-            elif char == ' ' and not name:
-                # Unless the name is not yet defined, a space
-                # is not something useful.
-                name, data = Name(data, space), ''
-                if validate:
-                    test_existence(self, name, stream, ancestors)
-                    test_parent(self, name, stream, ancestors)
-                    test_siblings(self, name, stream, ancestors)
-                # Create the name object for the element,
-                # composed of his namespace and name.
-                new = Element(name, ancestors[-1])
-                ancestors.append(new)
-            elif char == '=':
-                ancestors.append(Attribute(Name(data, keyspace)))
-                self.newattr(stream, ancestors, validate)
-                attr = ancestors.pop(-1)
-                ancestors[-1].append(attr)
-                data = ''
+        while True:
+            char = stream.skip()
+            if char == '>':
+                next(stream)
+                if isinstance(ancestors[-1], LazyElement):
+                    self.skipelement(stream, ancestors, validate)
+                break
             elif char == '/':
-                self.endelement(stream, ancestors, validate)
+                stream.upto('>')
+                self.closeelement(ancestors[-1].name, stream, ancestors,
+                                  validate)
                 break
-            elif char == '>':
-                if not name:
-                    name = Name(data, space)
-                    if validate:
-                        test_existence(self, name, stream, ancestors)
-                        test_parent(self, name, stream, ancestors)
-                        test_siblings(self, name, stream, ancestors)
-                    data = ''
-                    new = Element(name, ancestors[-1])
-                    ancestors.append(new)
+            elif not char:
                 break
-            else:
-                data += char
+            # An attribute's namespace and name.
+            key = stream.until(NAME_END)
+            if stream.skip() == '=':
+                next(stream)
+                ancestors.append(Attribute(self.names(key)))
+                self.newattr(stream, ancestors, validate)
+                attr = ancestors.pop(-1)
+                ancestors[-1].attrs[attr.name.text] = attr
 
-    def endelement(self, stream, ancestors, validate=False):
-        data, space, name = '', '', ''
-        for char in stream:
-            if char == ':':
-                space, data = data, ''
-            elif char == '>':
-                name, data = data, ''
-                new = ancestors.pop()
-                if validate:
-                    test_closing(self, new, name, stream, ancestors)
-                    test_kids(self, new, stream, ancestors)
-                ancestors[-1].append(new)
+    def openelement(self, data, ancestors, stream=None, validate=False,
+                    start=None):
+        name = self.names(data)
+        if validate:
+            test_existence(ancestors[0], name, stream, ancestors)
+            test_parent(ancestors[0], name, stream, ancestors)
+            test_siblings(ancestors[0], name, stream, ancestors)
+        # Create the element, composed of his namespace and name.
+        document = ancestors[0]
+        if len(ancestors) == document.lazy:
+            new = LazyElement(name, ancestors[-1], document)
+        else:
+            new = Element(name, ancestors[-1])
+        new.start = start
+        if document.indexes is not None:
+            document.indexes.opened(new)
+        ancestors.append(new)
+
+    def skipelement(self, stream, ancestors, validate=False):
+        # The content of a lazy element is only looked through for its end
+        # tag, and where it lies in the source is kept for later.
+        new = ancestors[-1]
+        tags = re.compile('<!--|<(/?)' + re.escape(str(new.name)) +
+                          r'(?=[\s/>])')
+        start = stream.position()
+        depth = 1
+        while depth:
+            tag = stream.search(tags)
+            end = stream.position()
+            if not tag:
                 break
-            else:
-                data += char
+            elif tag.group() == '<!--':
+                stream.upto('-->')
+            elif tag.group(1):
+                stream.upto('>')
+                depth -= 1
+            elif not stream.upto('>').endswith('/'):
+                depth += 1
+        new.span = start, end
+        self.closeelement(new.name, stream, ancestors, validate)
+
+    def endelement(self, stream, ancestors, validate=False):
+        # Where the end tag starts, past its '</'.
+        end = stream.tell() - 2
+        space, _, name = stream.upto('>').strip().rpartition(':')
+        self.closeelement(name, stream, ancestors, validate, end)
+
+    def closeelement(self, name, stream, ancestors, validate=False, end=None):
+        document = ancestors[0]
+        if document.source is not None:
+            # Documents keeping their source are edited, and broken for a
+            # while: an end tag closes the innermost open element of its
+            # name, and is ignored if none is open. The elements it closes
+            # on the way stop where it starts.
+            depth = len(ancestors) - 1
+            while depth and ancestors[depth].name != name:
+                depth -= 1
+            if not depth:
+                return
+            while len(ancestors) > depth + 1:
+                self.closeelement(ancestors[-1].name, stream, ancestors,
+                                  validate)
+                if end is not None:
+                    ancestors[-1][-1].stop = end
+        new = ancestors.pop()
+        if document.source is not None:
+            new.stop = stream.tell()
+        if validate:
+            test_closing(document, new, name, stream, ancestors)
+            test_kids(document, new, stream, ancestors)
+        if document.completed is not None and\
+           (new.name == document.wanted and
+            not any(node.name == document.wanted for node in ancestors[1:]) or
+            document.wanted is None and len(ancestors) == 2):
+            # The element is handed over instead of being kept in the tree,
+            # along with the white space separating it from the previous one.
+            # Elements nested in another one to hand over stay in it.
+            document.completed.append(new)
+            parent = ancestors[-1]
+            if len(parent) and isinstance(parent[-1], Text) and\
+               not parent[-1].data.strip():
+                del parent[-1]
+        else:
+            if document.indexes is not None:
+                document.indexes.addid(new)
+            # The element was indexed when opened, in document order.
+            list.append(ancestors[-1], new)
 
     def newpi(self, stream, ancestors, validate=False):
-        data = name = ''
-        attrs = {}
-        for char in stream:
-            if char == ' ':
-                # Unless the name is not yet defined, a space
-                # is not something useful.
-                if not name:
-                    name, data = data, ''
-                    # Create the name object for the element,
-                    # composed of his namespace and name.
-                    name = Name(name)
-                    new = ProcessingInstruction(name, ancestors[-1])
-                    ancestors.append(new)
-            elif char == '=':
-                ancestors.append(Attribute(Name(data)))
+        # Create the name object for the instruction.
+        name = self.names(stream.until(PI_END))
+        new = ProcessingInstruction(name, ancestors[-1])
+        ancestors.append(new)
+        while True:
+            char = stream.skip()
+            if char in ('?', ''):
+                # Oh, we reached the end of the P.I.
+                stream.upto('>')
+                break
+            key = stream.until(PI_END)
+            if stream.skip() == '=':
+                next(stream)
+                ancestors.append(Attribute(self.names(key)))
                 self.newattr(stream, ancestors, validate)
                 attr = ancestors.pop(-1)
                 ancestors[-1].append(attr)
-                data = ''
-            elif char == '?':
-                # Oh, we reached the end of the P.I.
-                for char in stream:
-                    # There may be spaces here, so we just
-                    # ignore them.
-                    if char == '>':
-                        break
-                if not name:
-                    name, data = data, ''
-                    # Create the name object for the element,
-                    # composed of his namespace and name.
-                    name = Name(name)
-                    new = ProcessingInstruction(name, ancestors[-1])
-                    ancestors.append(new)
-                else:
-                    new = ancestors.pop(-1)
-                ancestors[-1].append(new)
-                break
-            else:
-                data += char
+        new = ancestors.pop(-1)
+        ancestors[-1].append(new)
 
     def newdecl(self, stream, ancestors, validate=False):
-        data = ''
-        new = False
-        for char in stream:
-            if char == ' ':
-                if data in self.decls:
-                    self.decls[data](stream, ancestors)
-                    break
-                else:
-                    new = SGML(data)
-            elif char == '%':
+        if stream.peek() == '-':
+            # Comments do not need a space after their opening dashes.
+            data = next(stream) + next(stream, '')
+        else:
+            data = stream.until(DECL_END)
+        if data in self.decls:
+            self.decls[data](stream, ancestors, validate)
+            return
+        new = SGML(data)
+        while True:
+            stream.until(DECL_MARK)
+            char = next(stream, '')
+            if char == '%':
                 # Call for a new entity reference
                 self.newsysentref(stream, ancestors, validate)
             elif char == '[':
                 # The right bracket means that there is an inline definition
-                # embedded in the XML document. This means that it has to be parsed.
-                # To do so, a new parent node is created (new = SGML(data)).
-                if not new:
-                    new = SGML(data)
+                # embedded in the XML document. This means that it has to be
+                # parsed. To do so, the declaration becomes a parent node.
                 ancestors.append(new)
                 # The inline definitions can then be read by the parser, and
                 # appended to the document type.
-                self.declcontent(stream, ancestors, validate)
-                # And at the end of the process, the dtd is taken off the ancestors
-                # list to finish its parsing.
+                self.declcontent(stream, ancestors, validate=validate)
+                # And at the end of the process, the dtd is taken off the
+                # ancestors list to finish its parsing.
                 new = ancestors.pop(-1)
-            elif char == '>':
+            else:
                 ancestors[-1].append(new)
                 break
-            else:
-                data += char
 
     def newcomment(self, stream, ancestors, validate=False):
-        data = ''
-        for char in stream:
-            if char == '-' and data.endswith('-'):
-                ancestors[-1].append(MarkupComment(data[:-1]))
-                next(stream)
-                break
-            else:
-                data += char
+        data = stream.upto('-->')
+        if data.startswith(' '):
+            data = data[1:]
+        ancestors[-1].append(MarkupComment(data))
 
     def newdoctype(self, stream, ancestors, validate=False):
-        data = ''
-        for char in stream:
-            if char == '"':
+        stream.skip()
+        new = DocumentType(stream.until(DECL_END))
+        keyword = ''
+        while True:
+            char = stream.skip()
+            if char in ('"', '\''):
                 # Well formed URLs and URNs are contained in \' and \"
-                self.newstr(stream, ancestors, validate)
+                next(stream)
+                self.newstr(stream, ancestors, validate, char)
                 uri = ancestors.pop(-1)
                 new.location.append(uri)
-                # Obtain the doctype file if there is one.
-                ancestors.append(new)
-                self.dtdfile(uri, ancestors, validate)
-                new = ancestors.pop(-1)
+                if keyword == 'SYSTEM' or len(new.location) == 2:
+                    # Obtain the doctype file if there is one.
+                    ancestors.append(new)
+                    self.dtdfile(uri, ancestors, validate)
+                    new = ancestors.pop(-1)
             elif char == '[':
                 # Inline definitions are present, see comment in newdecl.
+                next(stream)
                 ancestors.append(new)
-                self.declcontent(stream, ancestors, validate)
+                self.declcontent(stream, ancestors, validate=validate)
                 new = ancestors.pop(-1)
-            elif char == ' ' and data:
-                if data not in ('PUBLIC', 'SYSTEM'):
-                    new = DocumentType(data)
-                data = ''
-            elif char == '>':
-                ancestors[-1].append(new)
-                break
             elif char == '%':
                 # Call for a new entity reference
+                next(stream)
                 self.newsysentref(stream, ancestors, validate)
-            elif char != ' ':
-                data += char
+            elif char in ('>', ''):
+                next(stream, '')
+                ancestors[-1].append(new)
+                break
+            else:
+                keyword = stream.until(WORD_END)
 
     def dtdfile(self, uri, ancestors, validate=False):
+        loc = self.resolve(uri, ancestors[0])
+        if isinstance(loc, str):
+            # Remote definitions are read at once.
+            with urlopen(loc) as file:
+                stream = Scanner(io.StringIO(file.read().decode()))
+        elif inarchive(loc):
+            # So are definitions from an archive, next to the document.
+            with openfile(loc) as file:
+                stream = Scanner(io.StringIO(file.read().decode()))
+        else:
+            with MappedStream(loc) as file:
+                self.declcontent(Scanner(file), ancestors, validate=validate)
+            return
+        self.declcontent(stream, ancestors, validate=validate)
+
+    def entityfile(self, uri, ancestors):
+        '''Read the text of an external entity, located like a DTD.'''
+        loc = self.resolve(uri, ancestors[0])
+        if isinstance(loc, str):
+            with urlopen(loc) as file:
+                return file.read().decode()
+        with openfile(loc) as file:
+            return file.read().decode()
+
+    def resolve(self, uri, document):
+        '''Locate a reference made from a document, as a URL string or as a
+        local path.'''
         name = urlparse(str(uri))
-        loc = Path(name.path)
-        tmp = Path('tmp')
-        if not tmp.exists(): tmp.mkdir()
         if name.scheme and name.netloc:
-            with urlopen(name) as file:
-                with (tmp / loc).open('w') as cache:
-                    cache.write(file.read())
-        else:
-            with loc.open('r') as file:
-                with (tmp / loc).open('w') as cache:
-                    cache.write(file.read())
-        stream = Stream(tmp / loc)
-        self.declcontent(stream, ancestors, validate)
+            return str(uri)
+        base = urlparse(document.base)
+        if base.scheme and base.netloc:
+            return urljoin(document.base, str(uri))
+        return Path(document.base).parent / name.path
 
     def newcmodel(self, stream, ancestors, validate=False):
-        data = ''
-        for char in stream:
-            if char == '>':
-                ancestors[-1].append(ElementType(name, content))
-                break
-            elif char == ' ' and data:
-                name = data
-                data = ''
-                try:
-                    content = self.defkids(stream, ancestors, name, validate)
-                except EndOfTag:
-                    break
-            elif char == '%':
-                # Call for a new entity reference
-                self.newsysentref(stream, ancestors, validate)
-            elif char != ' ':
-                data += char
+        while stream.skip() == '%':
+            # Call for a new entity reference
+            next(stream)
+            self.newsysentref(stream, ancestors, validate)
+        name = stream.until(MODEL_END)
+        try:
+            self.defkids(stream, ancestors, name, validate)
+        except EndOfTag:
+            pass
 
     def defkids(self, stream, ancestors=None, name=None, validate=False):
         data, minoccur, maxoccur = '', 1, 1
         kids = ContentRef()
-        for char in stream:
+        while True:
+            char = stream.skip()
+            if not char:
+                return
+            elif not MODEL_END.match(char):
+                # Names are read whole.
+                data += stream.until(MODEL_END)
+                continue
+            next(stream)
             if char == '(':
                 if not kids:
                     kids = self.defkids(stream, ancestors, validate=validate)
@@ -312,146 +444,213 @@ class Parser(Node):
                 raise EndOfTag('The element def. decl. is over.')
             elif char == '%':
                 self.newsysentref(stream, ancestors, validate)
-            elif char != ' ':
-                data += char
 
     def newattlist(self, stream, ancestors, validate=False):
-        data = ''
-        for char in stream:
-            if char == '>':
-                name = data
-                break
-            if char in ('\n', ' ') and data:
-                name = data
-                data = ''
-                attrs = self.defattrs(stream, ancestors, validate)
-                break
-            elif char == '%':
-                # Call for a new entity reference
-                self.newsysentref(stream, ancestors, validate)
-            elif char not in  ('\n', ' '):
-                data += char
+        while stream.skip() == '%':
+            # Call for a new entity reference
+            next(stream)
+            self.newsysentref(stream, ancestors, validate)
+        name = stream.until(WORD_END)
+        if stream.skip() == '>':
+            next(stream)
+            attrs, defaults = {}, {}
+        else:
+            attrs, defaults = self.defattrs(stream, ancestors, validate)
         mask = lambda x: isinstance(x, ElementType) and\
                          x.name == name
+        for attr, kind in attrs.items():
+            if kind == 'ID':
+                ancestors[0].declareid(name, attr)
         element = list(ancestors[-1].filter(mask))
         if element:
             element_def = element[0]
             element_def.attrs.update(attrs)
+            element_def.defaults.update(defaults)
         elif validate:
             raise ElementNotDefined('The element \'{}\' must be defined before it\
     is given attributes.'.format(name))
 
     def defattrs(self, stream, ancestors, validate=False):
-        data = ''
-        name = ''
-        attrs = {}
-        for char in stream:
-            if char == '>':
-                if data and name:
-                    attrs[name] = data
-                return attrs
-            elif char in ('\n', ' ') and name:
-                attrs[name] = data
-                name, data = '', ''
-            elif char in ('\n', ' '):
-                name = data
-                data = ''
+        # Each definition is a name, a type and a default: #REQUIRED,
+        # #IMPLIED, or a quoted value, after #FIXED or not. A definition
+        # without a default is ended by the name of the next one.
+        attrs, defaults = {}, {}
+        definition = []
+        def define(name, kind, *default):
+            attrs[name] = kind
+            if not default:
+                defaults[name] = '', None
+            elif isinstance(default[-1], Text):
+                defaults[name] = default[0] if len(default) == 2 else '',\
+                                 default[-1]
+            else:
+                defaults[name] = default[0], None
+        while True:
+            char = stream.skip()
+            if char in ('>', ''):
+                next(stream, '')
+                if len(definition) >= 2:
+                    define(*definition)
+                return attrs, defaults
             elif char == '%':
                 # Call for a new entity reference
+                next(stream)
                 self.newsysentref(stream, ancestors, validate)
-            elif char not in  ('\n', ' '):
-                data += char
+                continue
+            elif char in ('"', '\''):
+                next(stream)
+                self.newstr(stream, ancestors, validate, char)
+                token = ancestors.pop(-1)
+            elif char == '(':
+                # Enumerated values, which may hold spaces.
+                next(stream)
+                token = '(' + ''.join(stream.upto(')').split()) + ')'
+            else:
+                token = stream.until(WORD_END)
+                if not token:
+                    # A stray character, which cannot start a token.
+                    next(stream)
+                    continue
+            if len(definition) == 2 and isinstance(token, str) and\
+               not token.startswith('#'):
+                if definition[1] == 'NOTATION' and token.startswith('('):
+                    definition[1] += ' ' + token
+                    continue
+                define(*definition)
+                definition = []
+            definition.append(token)
+            if len(definition) == 4 or len(definition) == 3 and\
+               (isinstance(token, Text) or token != '#FIXED'):
+                define(*definition)
+                definition = []
 
     def newentdef(self, stream, ancestors, validate=False):
-        data = ''
         name = ''
-        value = ''
+        value = Text('')
         system = False
-        remote = False
-        for char in stream:
+        # Literals left before the system identifier of an external entity:
+        # none after SYSTEM, the public identifier after PUBLIC
+        remote = None
+        while True:
+            char = stream.skip()
             if char == '%':
+                next(stream)
                 system = True
-            elif char == ' ' and data == 'SYSTEM':
-                remote = True
-            elif char == ' ' and data:
-                name, data = data, ''
-            elif char == '"' and remote:
-                self.newstr(stream, ancestors, validate)
-                address = ancestors.pop(-1)
-                file = urlretrieve(uri)
-                value = open(file[0], 'r').read()
-            elif char == '"':
-                self.newstr(stream, ancestors, validate)
+            elif char in ('"', '\''):
+                next(stream)
+                self.newstr(stream, ancestors, validate, char)
                 value = ancestors.pop(-1)
-            elif char == '>':
+                if remote:
+                    remote -= 1
+                elif remote == 0:
+                    value = Text(self.entityfile(str(value), ancestors))
+                    remote = None
+            elif char in ('>', ''):
+                next(stream, '')
                 new = EntityDefinition(name, value, system)
                 ancestors[-1].append(new)
+                # Definitions are also indexed by name, for references.
+                document = ancestors[0]
+                if system:
+                    document.parameters[name] = new
+                else:
+                    document.entities[name] = new
                 break
-            elif char != ' ':
-                data += char
+            else:
+                data = stream.until(WORD_END)
+                if data == 'SYSTEM':
+                    remote = 0
+                elif data == 'PUBLIC':
+                    remote = 1
+                elif not name:
+                    name = data
+                elif not data:
+                    # A stray character, which cannot start a token.
+                    next(stream)
 
     def newsysentref(self, stream, ancestors, validate=False):
-        name = ''
-        for char in stream:
-            if char == ';':
-                break
-            else:
-                name += char
-        mask = lambda x: isinstance(x, EntityDefinition) and (x.name == name)\
-                         and x.system
-        entdef = list(ancestors[-1].filter(mask, 0))
-        if entdef:
-            value = entdef[-1].value
-            pos = stream.tell()
-            start = pos - len(name) - 2
-            stream[start:pos] = str(value.escape())
-            stream.seek(start)
+        name = stream.upto(';')
+        entdef = ancestors[0].parameters.get(name, None)
+        if entdef is not None:
+            # Parameter entities hold markup, which is read as it is.
+            stream.push(str(entdef.value))
         elif validate:
             raise Exception('Entity Not Defined.')
 
-    def newstr(self, stream, ancestors, validate=False):
-        data = ''
-        fake_ancestors = [[Text('')]]
-        for char in stream:
-            if char == '"':
-                ancestors.append(fake_ancestors[-1][-1] + Text(data))
+    def newstr(self, stream, ancestors, validate=False, quote='"'):
+        # The document comes first, for entity references to be looked up.
+        fake_ancestors = [ancestors[0], [Text('')]]
+        while True:
+            data = stream.until(STRING_END[quote])
+            self.newtext(fake_ancestors, data, validate)
+            if next(stream, quote) == quote:
+                ancestors.append(fake_ancestors[-1][-1])
                 break
-            elif char == '&':
-                fake_ancestors[-1][-1].extend(Text(data))
-                data = ''
-                self.newentref(stream, fake_ancestors, validate)
-            else:
-                data += char
+            self.newentref(stream, fake_ancestors, validate)
 
     def declcontent(self, stream, ancestors, file=False, validate=False):
-        for char in stream:
-            if char == ']':
+        while True:
+            stream.until(DTD_MARK)
+            char = next(stream, '')
+            if char in (']', ''):
                 break
             elif char == '%':
                 # Call for a new entity reference
                 self.newsysentref(stream, ancestors, validate)
-            if char == '<':
+            else:
                 char = next(stream)
                 if char == '!':
                     self.newdecl(stream, ancestors, validate)
                 elif char == '?':
                     self.newpi(stream, ancestors, validate)
-                elif valdiate:
+                elif validate:
                     raise Exception('This tag should be an SGML decl.')
 
+    def ignorable(self, ancestors):
+        '''Whether white space starting a text node in the current node is
+        ignorable: outside of the root element, in elements whose content
+        model does not allow #PCDATA, or anywhere without a DTD.'''
+        parent = ancestors[-1]
+        if len(parent) and isinstance(parent[-1], Text):
+            # It goes on with the text before it.
+            return False
+        elif isinstance(parent, Element):
+            return not self.ismixed(ancestors[0], str(parent.name))
+        return parent is ancestors[0]
+
+    def ismixed(self, document, name):
+        '''Whether the content model of the elements named name allows
+        character data. Without a DTD, none does, and elements it does not
+        declare are taken to.'''
+        mixed = document.mixed
+        if not mixed:
+            # The whole DTD is looked through once, when it is complete.
+            doctypes = [node for node in document
+                        if isinstance(node, DocumentType)]
+            mixed[None] = bool(doctypes)
+            for node in doctypes[0] if doctypes else ():
+                if not isinstance(node, ElementType):
+                    continue
+                models, mixed[node.name] = [node.content], False
+                while models:
+                    model = models.pop()
+                    if isinstance(model, (Characters, Any)):
+                        mixed[node.name] = True
+                        break
+                    elif isinstance(model, ContentRef):
+                        models.extend(model)
+        return mixed.get(name, mixed[None])
+
     def newtext(self, ancestors, text, validate=False):
+        if not text:
+            return
         if len(ancestors[-1]) and isinstance(ancestors[-1][-1], Text):
             ancestors[-1][-1].extend(text)
         else:
             ancestors[-1].append(Text(text))
 
     def newentref(self, stream, ancestors, validate=False):
-        name = ''
-        for char in stream:
-            if char == ';':
-                break
-            else:
-                name += char
+        name = stream.upto(';')
         if name in default_entities:
             self.newtext(ancestors, default_entities[name], validate)
         elif name.startswith('#'):
@@ -461,55 +660,229 @@ class Parser(Node):
         elif name.startswith('0o'):
             self.newtext(ancestors, chr(int(name[2:], 8)), validate)
         else:
-            mask = lambda x: isinstance(x, EntityDefinition) and\
-                             (x.name == name)\
-                             and not x.system
-            entdef = list(self.filter(mask, -1))
-            if entdef:
-                value = entdef[-1].value
-                pos = stream.tell()
-                start = pos - len(name) - 2
-                stream[start:pos] = str(value.escape())
-                stream.seek(start)
+            entdef = ancestors[0].entities.get(name, None)
+            if entdef is not None:
+                # The replacement text is read from memory, before the rest
+                # of the source.
+                stream.push(entdef.value.escape())
             elif validate:
                 raise Exception('Entity Not Defined.')
             else:
                 with open('entities_to_define', 'a+') as ent2def:
                     print(name, file=ent2def)
 
-    def __call__(self, loc, validate=False):
-        if len(self):
-            self.empty()
-        # Temporary accumulated data (characters)
-        data = ''
-        # The last element in the list is the one to append new elements to
-        ancestors = [self]
-        # The source characters generator
-        loc = Path(loc)
-        cwd = os.getcwd()
-        os.chdir(str(loc.parent))
-        stream = Stream(loc.name)
-        for char in stream:
-            # Basic parsing layer, to detect any context to get into
-            if char == '<':
-                self.newtext(ancestors, data, validate)
-                self.newtag(stream, ancestors, validate)
-                data = ''
-            elif char == '&':
-                # Entity reference layer
+    def parse(self, stream, ancestors, validate=False):
+        '''Parse the stream, down to the last whole token it holds.'''
+        while True:
+            # Where to come back to if the stream runs out in the middle
+            # of a token, along with the open elements at that point.
+            mark, context = stream.mark(), ancestors[:]
+            try:
+                # Basic parsing layer, to detect any context to get into
+                data = stream.until(TEXT_END, True)
+                try:
+                    char = stream.peek()
+                except NeedData:
+                    if data.isspace():
+                        raise
+                    # Character data can be split: what was read of it is
+                    # kept, and the rest is added to it from the next data.
+                    self.newtext(ancestors, data, validate)
+                    break
+                if data and ancestors[0].strip and char != '&' and\
+                   data.isspace() and self.ignorable(ancestors):
+                    data = ''
                 self.newtext(ancestors, data, validate)
-                self.newentref(stream, ancestors, validate)
-                data = ''
-            else:
-                data += char
-        os.chdir(cwd)
+                if not char:
+                    break
+                mark = stream.mark()
+                next(stream)
+                if char == '<':
+                    self.newtag(stream, ancestors, validate)
+                else:
+                    # Entity reference layer
+                    self.newentref(stream, ancestors, validate)
+            except NeedData:
+                stream.reset(mark)
+                ancestors[:] = context
+                stream.wait()
+                break
 
-    def __repr__(self):
-        return '<XML Parser at ' + hex(id(self)) + '>'
+    def iterparse(self, loc, tag=None, validate=False):
+        '''Parse the file at loc, yielding every element named tag as soon
+        as it is closed, with all of its content, nested elements of the
+        same name included.
+
+        Yielded elements are left out of the tree, so that they can be freed
+        once they are no longer used. Without a tag, the children of the
+        root element are yielded.'''
+        document = Document(loc, self)
+        document.wanted, document.completed = tag, []
+        with openfile(loc) as file:
+            while True:
+                data = file.read(CHUNK)
+                if data:
+                    document.feed(data, validate)
+                else:
+                    document.close(validate)
+                completed, document.completed = document.completed, []
+                yield from completed
+                if not data:
+                    break
+
+    def load(self, loc, validate=False, lazy=None, spans=False, strip=False,
+             indexed=False):
+        '''Parse the file at loc into a new Document.
+
+        With a lazy depth, the content of the elements at that depth (the
+        root element being at depth 1) is only parsed when first accessed.
+        With spans, the document keeps its source text, and its elements
+        their start and stop offsets in it, so that it can be edit()ed.
+        With strip, text made only of white space is dropped wherever it is
+        ignorable, see ignorable(). With indexed, the document keeps indexes
+        of its elements by name and ID, see Indexes.'''
+        if lazy:
+            # Lazy elements read the file again later, wherever the current
+            # directory is by then.
+            loc = os.path.abspath(str(loc))
+        document = Document(loc, self)
+        document.lazy, document.strip = lazy, strip
+        if indexed:
+            document.indexes = Indexes(document)
+        if spans:
+            if lazy:
+                raise ValueError('Lazy elements do not track their spans.')
+            with openfile(loc) as file:
+                document.source = file.read().decode()
+            self.reparse(document, document.source, validate)
+        else:
+            self.builder(self, document).parsefile(loc, validate)
+        return document
+
+    def reparse(self, document, source, validate=False):
+        '''Parse the whole source text again into document.
+
+        The source is parsed apart, and only takes the place of the tree
+        once it was read without error, so that a failed parse leaves the
+        document as it was.'''
+        scratch = Document(document.base, self)
+        scratch.lazy, scratch.strip = document.lazy, document.strip
+        scratch.source = source
+        builder = self.builder(self, scratch)
+        builder.feed(source, validate)
+        builder.close(validate)
+        indexed = document.indexes is not None
+        document.empty()
+        vars(document).update(vars(scratch))
+        list.extend(document, scratch)
+        for node in document:
+            if isinstance(node, Node):
+                node.parent = document
+        if indexed:
+            document.indexelements()
+        return list(document)
 
-    def __str__(self):
-        mask = lambda x: str(x) not in ('\n', ' ') if isinstance(x, Text)\
-                                                   else True
-        escape = lambda x: x.escape() if isinstance(x, Text) else x
-        return '\n'.join(str(escape(node)) for node in self.filter(mask))
+    def edit(self, document, offset, deleted, inserted='', validate=False):
+        '''Apply an edit to the source text of a document loaded with spans:
+        deleted characters are removed at offset, and replaced by the
+        inserted text.
 
+        Only the smallest element holding the edit is parsed again, and its
+        new nodes take its place in the tree. If its new source does not
+        close all it opens, or closes more, its parent is tried instead, up
+        to the whole document. Return the new nodes.'''
+        old = document.source
+        if old is None:
+            raise ValueError('The document does not keep its source.')
+        end = offset + deleted
+        delta = len(inserted) - deleted
+        source = old[:offset] + inserted + old[end:]
+        # The innermost element holding the edit, tags excluded.
+        node, element = document, None
+        while node is not None:
+            node, parent = None, node
+            for kid in parent:
+                if isinstance(kid, Element) and kid.start is not None and\
+                   kid.start < offset and end < kid.stop:
+                    node = element = kid
+                    break
+        while isinstance(element, Element):
+            nodes = self.respan(document, element, source, delta, validate)
+            if nodes is not None:
+                break
+            element = element.parent
+        else:
+            return self.reparse(document, source, validate)
+        # Everything after the element moves with the edit.
+        node = element
+        while node is not document:
+            parent = node.parent
+            if isinstance(parent, Element):
+                parent.stop += delta
+            index = next(i for i, kid in enumerate(parent) if kid is node)
+            stack = parent[index+1:]
+            while stack:
+                kid = stack.pop()
+                if isinstance(kid, Element) and kid.start is not None:
+                    kid.start += delta
+                    kid.stop += delta
+                    stack.extend(kid)
+            node = parent
+        # The new nodes replace the element, merging with the text around.
+        parent = element.parent
+        index = next(i for i, kid in enumerate(parent) if kid is element)
+        parent[index:index+1] = nodes
+        for kid in nodes:
+            if isinstance(kid, Node):
+                kid.parent = parent
+        for i in (index + len(nodes), index):
+            if 0 < i < len(parent) and isinstance(parent[i-1], Text) and\
+               isinstance(parent[i], Text):
+                parent[i-1].extend(parent[i])
+                del parent[i]
+        document.source = source
+        return nodes
+
+    def respan(self, document, element, source, delta, validate=False):
+        '''Parse the new source of an element, and return its nodes, or
+        None if they are not balanced.'''
+        # The source is read under stand-ins for the ancestors of the
+        # element, with the entity definitions of the document.
+        scratch = Document(document.base, self)
+        scratch.entities, scratch.parameters = document.entities,\
+                                               document.parameters
+        scratch.source = source
+        if document.strip:
+            self.ismixed(document, None)
+            scratch.strip, scratch.mixed = True, document.mixed
+        builder = self.builder(self, scratch)
+        for ancestor in list(element.ancestors())[-2::-1]:
+            builder.ancestors.append(Element(ancestor.name,
+                                             builder.ancestors[-1]))
+        context = builder.ancestors[:]
+        builder.stream = Scanner()
+        builder.stream.offset = element.start
+        try:
+            builder.feed(source[element.start:element.stop+delta], validate)
+            # A token running past the end of the element, like a reference
+            # missing its ';', is read otherwise in the whole source.
+            if builder.stream.waiting:
+                return None
+            builder.close(validate)
+        except IndexError:
+            # More elements were closed than there were open.
+            return None
+        if len(builder.ancestors) != len(context) or\
+           builder.ancestors[-1] is not context[-1]:
+            return None
+        return list(context[-1])
+
+    def __call__(self, loc, validate=False, strip=False, indexed=False):
+        self.empty()
+        self.base = str(loc)
+        self.strip = strip
+        self.indexes = Indexes(self) if indexed else None
+        self.builder(self, self).parsefile(loc, validate)
+
+    def __repr__(self):
+        return '<XML Parser at ' + hex(id(self)) + '>'
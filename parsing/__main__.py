@@ -0,0 +1,48 @@
+import sys, argparse
+sys.path.append('../..')
+
+from Cassiopee.parsing.batch import parse_many
+from Cassiopee.parsing.index import Index
+
+def count(tree):
+    '''Reduce a tree to its number of nodes.'''
+    return sum(1 for node in tree.filter(walk=-1))
+
+def main(args=None):
+    cli = argparse.ArgumentParser(prog='python -m Cassiopee.parsing',
+                                  description='Parse XML files in parallel.')
+    cli.add_argument('paths', nargs='+', help='files to parse')
+    cli.add_argument('-j', '--workers', type=int, default=None,
+                     help='number of worker processes (default: all cores)')
+    cli.add_argument('--validate', action='store_true',
+                     help='validate the files against their DTD')
+    cli.add_argument('--chunksize', type=int, default=1,
+                     help='files sent to a worker at once')
+    cli.add_argument('--index', action='store_true',
+                     help='index the children of the root element instead')
+    cli.add_argument('-a', '--attr', action='append', default=[],
+                     help='attribute whose values are indexed (default: id)')
+    args = cli.parse_args(args)
+    if args.index:
+        for path in args.paths:
+            index = Index(path, args.attr or ['id'])
+            print('{}\t{} children\t{}'.format(path, len(index),
+                                               index.sidecar))
+        return 0
+    results = parse_many(args.paths, args.workers, count, args.validate,
+                         args.chunksize)
+    failed = 0
+    for result in results:
+        if result:
+            print('{}\t{:.4f}s\t{} nodes'.format(result.path, result.duration,
+                                                 result.value))
+        else:
+            failed += 1
+            print('{}\t{:.4f}s\t{}'.format(result.path, result.duration,
+                                           result.error))
+    print('{} files, {} failed, {:.4f}s spent parsing'.format(
+            len(results), failed, sum(r.duration for r in results)))
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,81 @@
+import sys, gzip, tarfile, zipfile, posixpath
+from pathlib import Path
+sys.path.append('../..')
+
+class Member:
+    '''Member of an archive, read through decompression without being
+    extracted. Closing it closes the archive.'''
+
+    def __init__(self, file, archive):
+        self.file = file
+        self.archive = archive
+
+    def read(self, size=-1):
+        return self.file.read(size)
+
+    def seek(self, pos, whence=0):
+        return self.file.seek(pos, whence)
+
+    def tell(self):
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+        self.archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, trace):
+        self.close()
+
+def split(loc):
+    '''Split a location into the archive holding it and the path of the
+    member inside it, like 'source.zip' and 'source/source.xml' for
+    'source.zip/source/source.xml'.
+
+    A gzipped file is an archive of a single member, whose path is None.
+    Locations outside of any archive give (None, None).'''
+    path = Path(str(loc))
+    if path.is_file():
+        if path.suffix == '.gz':
+            return path, None
+        return None, None
+    for archive in path.parents:
+        if archive.is_file():
+            member = posixpath.normpath(path.relative_to(archive).as_posix())
+            return archive, member
+    return None, None
+
+def inarchive(loc):
+    '''Whether the location is read out of an archive.'''
+    return split(loc)[0] is not None
+
+def openfile(loc):
+    '''Open the file at loc for reading bytes, out of its archive if it is
+    in one: zip, tar (compressed or not) or gzip.'''
+    archive, member = split(loc)
+    if archive is None:
+        return open(str(loc), 'rb')
+    elif member is None:
+        return gzip.open(str(archive), 'rb')
+    elif zipfile.is_zipfile(str(archive)):
+        folder = zipfile.ZipFile(str(archive))
+        try:
+            return Member(folder.open(member), folder)
+        except KeyError:
+            folder.close()
+            raise FileNotFoundError('No member {} in {}.'.format(member,
+                                                                 archive))
+    elif tarfile.is_tarfile(str(archive)):
+        folder = tarfile.open(str(archive))
+        try:
+            file = folder.extractfile(member)
+        except KeyError:
+            file = None
+        if file is None:
+            folder.close()
+            raise FileNotFoundError('No member {} in {}.'.format(member,
+                                                                 archive))
+        return Member(file, folder)
+    raise FileNotFoundError('{} is not an archive.'.format(archive))
@@ -1,3 +1,4 @@
+import re
 from types import FunctionType, GeneratorType
 
 # == Global constants ==
@@ -32,36 +33,76 @@ occurs = {'+': (1, Inf()), '?': (0, 1), '*': (0, Inf())}
 
 # == XML Tree Basic Classes ==
 class Name:
-    '''Name of an XML node.'''
+    '''Name of an XML node.
+
+    Names are immutable: their qualified form and its hash are computed
+    once. Those given out by a Names table are shared by all the nodes of
+    the same name, and are then compared by identity.'''
+
+    __slots__ = ('name', 'space', 'text', 'hash')
 
     def __init__(self, name, space=''):
-        self.name = name
-        self.space = space
+        setattr = super().__setattr__
+        setattr('name', name)
+        setattr('space', space)
+        setattr('text', space + ':' + name if space else name)
+        setattr('hash', hash(self.text))
+
+    def __setattr__(self, key, value):
+        raise AttributeError('Names cannot be changed.')
+
+    def __delattr__(self, key):
+        raise AttributeError('Names cannot be changed.')
+
+    def __reduce__(self):
+        return Name, (self.name, self.space)
 
     def __repr__(self):
         return '<XML Element Name ' + self.space + ':' + self.name +\
                ' at ' + hex(id(self)) + '>'
 
     def __str__(self):
-        return self.space + ':' + self.name
-
-    def __str__(self):
-        if self.space:
-            return self.space + ':' + self.name
-        else:
-            return self.name
+        return self.text
 
     def __eq__(self, other):
-        if isinstance(other, str):
-            return other == self.name
+        if other is self:
+            return True
+        elif isinstance(other, str):
+            # A string names an element by its qualified or its local name.
+            return other == self.name or other == self.text
         elif isinstance(other, Name):
-            return other.name == self.name and other.space == self.space
+            return other.text == self.text
 
     def __hash__(self):
-        return hash(str(self))
+        return self.hash
+
+class Names:
+    '''Symbol table of a parser, which interns names: every qualified name,
+    like 'xml:lang', is given a single shared Name.'''
+
+    __slots__ = ('names',)
+
+    def __init__(self):
+        self.names = {}
+
+    def __call__(self, data):
+        name = self.names.get(data)
+        if name is None:
+            space, _, local = data.rpartition(':')
+            # Parsers used by many threads at once keep the first Name made.
+            name = self.names.setdefault(data, Name(local, space))
+        return name
+
+    def __len__(self):
+        return len(self.names)
 
 class Node(list):
-    '''XML Node.'''
+    '''XML Node.
+
+    Nodes and their subclasses declare their attributes in __slots__, and
+    have no instance dictionary, to keep large trees small.'''
+
+    __slots__ = ('name', 'parent')
 
     def __init__(self):
         # Variables used for normal behavior, as root of the DOM tree
@@ -78,8 +119,20 @@ class Node(list):
             for level in index:
                 current = current[level]
             return current
-        elif isinstance(index, (str, dict, FunctionType)):
-            # If the index is a string, function or dictionnary,
+        elif isinstance(index, (str, Name)):
+            # If the index is a name, the elements of that name are picked
+            # out, from the indexes of the document if it keeps some.
+            from Cassiopee.parsing.nodes import Element
+            parent = Node()
+            indexes = getattr(self.top(), 'indexes', None)
+            if indexes is not None:
+                parent.extend(indexes.within(self, index))
+            else:
+                parent.extend(self.filter(lambda x: isinstance(x, Element) and
+                                                    x.name == index, -1))
+            return parent
+        elif isinstance(index, (dict, FunctionType)):
+            # If the index is a function or dictionnary,
             # it is used as a filter.
             parent = Node()
             parent.extend(self.filter(index, -1))
@@ -98,7 +151,20 @@ class Node(list):
             for index in indexes:
                 self[index] = value
         else:
-            super().__setitem__(index, value)
+            indexes = getattr(self.top(), 'indexes', None)
+            if indexes is None:
+                return super().__setitem__(index, value)
+            old = super().__getitem__(index)
+            new = list(value) if isinstance(index, slice) else [value]
+            indexes.remove(old if isinstance(index, slice) else [old])
+            super().__setitem__(index, new if isinstance(index, slice)
+                                           else value)
+            if isinstance(index, slice) and index.step not in (None, 1):
+                # The new nodes are not next to each other.
+                for node in new:
+                    indexes.add([node], self)
+            else:
+                indexes.add(new, self)
 
     def __delitem__(self, index):
         if isinstance(index, (tuple, list)):
@@ -111,13 +177,65 @@ class Node(list):
             for index in indexes:
                 del self[index]
         else:
+            indexes = getattr(self.top(), 'indexes', None)
+            if indexes is not None:
+                old = super().__getitem__(index)
+                indexes.remove(old if isinstance(index, slice) else [old])
             super().__delitem__(index)
 
+    def append(self, node):
+        super().append(node)
+        if isinstance(node, Node):
+            indexes = getattr(self.top(), 'indexes', None)
+            if indexes is not None:
+                indexes.add([node], self)
+
+    def insert(self, index, node):
+        super().insert(index, node)
+        if isinstance(node, Node):
+            indexes = getattr(self.top(), 'indexes', None)
+            if indexes is not None:
+                indexes.add([node], self)
+
+    def extend(self, nodes):
+        indexes = getattr(self.top(), 'indexes', None)
+        if indexes is None:
+            return super().extend(nodes)
+        nodes = list(nodes)
+        super().extend(nodes)
+        indexes.add(nodes, self)
+
+    def __iadd__(self, nodes):
+        self.extend(nodes)
+        return self
+
+    def pop(self, index=-1):
+        indexes = getattr(self.top(), 'indexes', None)
+        if indexes is not None:
+            indexes.remove([super().__getitem__(index)])
+        return super().pop(index)
+
+    def remove(self, node):
+        indexes = getattr(self.top(), 'indexes', None)
+        if indexes is not None:
+            indexes.remove([super().__getitem__(self.index(node))])
+        super().remove(node)
+
     def __repr__(self):
         return '<XML Node ' + str(self.name) + ' at ' + hex(id(self)) + '>'
 
+    def top(self):
+        '''Root of the tree holding the node.'''
+        node = self
+        while True:
+            parent = getattr(node, 'parent', None)
+            if parent is None or parent is node:
+                return node
+            node = parent
+
     def children(self, cond=lambda x: True, walk=0):
         '''Filter for child nodes.'''
+        from Cassiopee.parsing.nodes import Element
         for child in self.filter(cond, walk):
             if isinstance(child, Element):
                 yield child
@@ -190,65 +308,120 @@ class Node(list):
     def empty(self):
         del self[:]
 
+    def freeze(self):
+        '''Take a read-only snapshot of the tree, see frozen.Frozen.'''
+        from Cassiopee.parsing.frozen import freeze
+        return freeze(self)
+
     @property
-    def id(self, value=''):
-        idattr = self.model.get('id', None)
-        if value:
-            self.attr(idattr, value)
-        else:
-            return self.attr(idattr)
+    def id(self):
+        '''Value of the ID attribute of the node, if it has one.'''
+        attrs = getattr(self, 'attrs', None)
+        if not attrs:
+            return None
+        root = self.top()
+        names = root.idnames(self.name) if hasattr(root, 'idnames') else\
+                ('id', 'xml:id')
+        for name in names:
+            if name in attrs:
+                return attrs[name].value()
+        return None
+
+# Runs of white space, collapsed to a single space in text.
+SPACES = re.compile('[\n\r \t]+')
+
+class Text:
+    '''Character data, stored as a string.
+
+    Text added by extend() is kept aside and joined to the rest when the
+    text is next read, and the collapsed and escaped forms are computed
+    once, until the text changes again.'''
 
-class Text(list):
+    __slots__ = ('parts', 'collapsed', 'escaped')
 
-    def __init__(self, value):
-        super().__init__(value)
+    def __init__(self, value=''):
+        if isinstance(value, Text):
+            value = value.data
+        elif not isinstance(value, str):
+            value = ''.join(value)
+        self.parts = [value]
+        self.collapsed, self.escaped = None, None
+
+    @property
+    def data(self):
+        '''The text, as it was read.'''
+        parts = self.parts
+        if len(parts) > 1:
+            parts[:] = [''.join(parts)]
+        return parts[0]
 
     def __repr__(self):
         return '<Text node at ' + hex(id(self)) + '>'
 
     def __str__(self):
-        return ''.join(self.collapse())
+        return self.collapse().data
+
+    def __len__(self):
+        return len(self.data)
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __getitem__(self, index):
+        return self.data[index]
+
+    def __contains__(self, text):
+        return str(text) in self.data
+
+    def __eq__(self, other):
+        if isinstance(other, Text):
+            return self.data == other.data
+        elif isinstance(other, str):
+            return self.data == other
+        return NotImplemented
 
     def __hash__(self):
-        return hash(str(self.collapse))
+        return hash(self.data)
 
     def collapse(self):
-        collapsed = Text('')
-        for char in self:
-            if char in ('\n', '\r', ' ', '\t'):
-                if collapsed and collapsed[-1] == ' ':
-                    continue
-                else:
-                    collapsed.append(' ')
-            else:
-                collapsed.append(char)
-        return collapsed
+        if self.collapsed is None:
+            self.collapsed = Text(SPACES.sub(' ', self.data))
+        return self.collapsed
 
     def startswith(self, text):
-        for i, char in enumerate(text):
-            if char != self[i]:
-                return False
-        return True
+        return self.data.startswith(text.data if isinstance(text, Text)
+                                    else text)
 
     def endswith(self, text):
-        for i, char in enumerate(text[-1:-len(text):-1]):
-            if char != self[-i-1]:
-                return False
-        return True
+        return self.data.endswith(text.data if isinstance(text, Text)
+                                  else text)
+
+    def extend(self, text):
+        if isinstance(text, Text):
+            text = text.data
+        elif not isinstance(text, str):
+            text = ''.join(text)
+        if text:
+            self.parts.append(text)
+            self.collapsed, self.escaped = None, None
+    append = extend
 
     def __add__(self, other):
-        return Text([i for i in self] + [i for i in other])
+        return Text(self.data + Text(other).data)
 
     def __iadd__(self, other):
-        self.extend(i for i in other)
+        self.extend(other)
+        return self
 
     def __radd__(self, other):
-        return Text([i for i in other] + [i for i in self])
+        return Text(Text(other).data + self.data)
 
     def escape(self):
-        output = str(self)
-        output = output.replace('&', '&amp;')
-        output = output.replace('<', '&lt;')
-        output = output.replace('\'', '&apos;')
-        output = output.replace('\"', '&quot;')
-        return output
+        if self.escaped is None:
+            output = str(self)
+            output = output.replace('&', '&amp;')
+            output = output.replace('<', '&lt;')
+            output = output.replace('\'', '&apos;')
+            output = output.replace('\"', '&quot;')
+            self.escaped = output
+        return self.escaped
@@ -0,0 +1,177 @@
+import sys, os, os.path, re, mmap, gc
+from concurrent.futures import ProcessPoolExecutor
+sys.path.append('../..')
+
+from Cassiopee.timetools import Timer
+
+class Result:
+    '''Outcome of parsing one file of a batch.'''
+
+    def __init__(self, path, value=None, duration=0.0, error=None):
+        self.path = path
+        # The parsed tree, or what the reduction made of it.
+        self.value = value
+        # Time spent parsing and reducing, in seconds.
+        self.duration = duration
+        # Description of what went wrong, if anything did.
+        self.error = error
+
+    def __bool__(self):
+        return self.error is None
+
+    def __repr__(self):
+        status = 'failed' if self.error else 'parsed'
+        return '<{} {} in {:.4f}sec at {}>'.format(status, self.path,
+                                                    self.duration,
+                                                    hex(id(self)))
+
+def parse_one(path, reduce=None, validate=False):
+    '''Parse a single file, catching any error, and time it.'''
+    from Cassiopee.parsing import Parser
+    timer = Timer()
+    timer.start()
+    try:
+        value = Parser().load(path, validate)
+        if reduce is not None:
+            value = reduce(value)
+    except Exception as error:
+        timer.stop()
+        return Result(path, None, timer.duration,
+                      '{}: {}'.format(type(error).__name__, error))
+    timer.stop()
+    return Result(path, value, timer.duration)
+
+def parse_some(paths, reduce=None, validate=False):
+    '''Parse a few files, one after the other, into a list of Results.'''
+    return [parse_one(path, reduce, validate) for path in paths]
+
+def parse_many(paths, workers=None, reduce=None, validate=False,
+               chunksize=1):
+    '''Parse many files in a pool of worker processes.
+
+    Return a Result for each path, in the same order. Each holds the tree,
+    or reduce(tree) if a reduction is given. A reduction must be a function
+    defined at module level, so that it can be sent to the workers. Since
+    trees are pickled back from the workers, a reduction returning less
+    than the whole tree is faster. A file that cannot be parsed gives a
+    Result with an error, and the rest of the batch goes on.
+
+    Files are sent to the workers chunksize at a time. When a chunk cannot
+    be sent or sent back, for instance because a value cannot be pickled,
+    or when its worker dies, every file of the chunk gives a Result with
+    an error.
+
+    With a single worker, everything is parsed in this process.'''
+    paths = [os.path.abspath(str(path)) for path in paths]
+    if workers == 1:
+        return parse_some(paths, reduce, validate)
+    chunks = [paths[i:i+chunksize] for i in range(0, len(paths), chunksize)]
+    results = []
+    with ProcessPoolExecutor(workers) as pool:
+        futures = [pool.submit(parse_some, chunk, reduce, validate)
+                   for chunk in chunks]
+        for chunk, future in zip(chunks, futures):
+            try:
+                results.extend(future.result())
+            except Exception as error:
+                error = '{}: {}'.format(type(error).__name__, error)
+                results.extend(Result(path, error=error) for path in chunk)
+    return results
+
+def chunk_document(path, start, stop, entities={}, parameters={}):
+    '''Parse the nodes between two offsets of a file, with the entity
+    definitions of its prolog, into a new Document.'''
+    from Cassiopee.parsing import Parser, Document
+    parser = Parser()
+    document = Document(path, parser)
+    document.entities.update(entities)
+    document.parameters.update(parameters)
+    with open(path, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            builder = parser.builder(parser, document)
+            builder.feed(data[start:stop])
+            builder.close()
+    return document
+
+def parse_chunk(path, start, stop, entities={}, parameters={}):
+    '''Parse the nodes between two offsets of a file, with the entity
+    definitions of its prolog, and return them.'''
+    return list(chunk_document(path, start, stop, entities, parameters))
+
+def freeze_chunk(path, start, stop, entities={}, parameters={}):
+    '''Parse the nodes between two offsets of a file, like parse_chunk(),
+    and return them as a Frozen tree under a document, which is much faster
+    to send back from a worker than the nodes are.'''
+    from Cassiopee.parsing import freeze
+    # Nothing the worker makes is garbage before it is sent back, so the
+    # cyclic garbage collector would only go through the nodes in vain.
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        return freeze(chunk_document(path, start, stop, entities,
+                                     parameters))
+    finally:
+        if collecting:
+            gc.enable()
+
+def parse_split(path, tag, workers=None, chunks=None):
+    '''Parse a single large document in a pool of worker processes.
+
+    The children of the root element are split into chunks at the start
+    tags of the repeated element named tag, which must neither nest in
+    itself nor appear in comments. The prolog and the root start tag are
+    parsed once, here, and their entity definitions are sent to every
+    worker. The chunks come back as Frozen trees, which are thawed into
+    nodes and stitched back under the root element in document order.
+    Return the Document.'''
+    from Cassiopee.parsing import Parser, Document, Node, Text
+    parser = Parser()
+    path = os.path.abspath(str(path))
+    workers = workers or os.cpu_count() or 1
+    chunks = chunks or workers * 4
+    tag = re.escape(tag.encode())
+    opening = re.compile(b'<' + tag + rb'[\s/>]')
+    closing = re.compile(b'</' + tag + rb'\s*>')
+    with open(path, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            first = opening.search(data)
+            last = None
+            if first:
+                for last in closing.finditer(data, first.start()):
+                    pass
+            if not first or not last:
+                return parser.load(path)
+            # The head ends with its last tag, leaving the white space
+            # before the first record to the first chunk.
+            first = data.rfind(b'>', 0, first.start()) + 1
+            last = last.end()
+            bounds, step = [first], (last - first) // chunks + 1
+            for i in range(1, chunks):
+                split = opening.search(data, max(first + i * step,
+                                                 bounds[-1] + 1), last)
+                if not split:
+                    break
+                bounds.append(split.start())
+            bounds.append(last)
+            head, tail = data[:first], data[last:]
+    document = Document(path, parser)
+    document.feed(head)
+    # The open elements, down to the root element.
+    ancestors = document.pending.ancestors
+    with ProcessPoolExecutor(workers) as pool:
+        results = pool.map(freeze_chunk, [path] * (len(bounds) - 1),
+                           bounds[:-1], bounds[1:],
+                           [document.entities] * (len(bounds) - 1),
+                           [document.parameters] * (len(bounds) - 1))
+        root = ancestors[-1]
+        for frozen in results:
+            nodes = list(frozen.thaw(0, parser.names))
+            # Text at the start of a chunk goes on the text before it.
+            if nodes and isinstance(nodes[0], Text):
+                parser.newtext(ancestors, nodes.pop(0))
+            for node in nodes:
+                if isinstance(node, Node):
+                    node.parent = root
+            list.extend(root, nodes)
+    document.feed(tail)
+    return document.close()
@@ -4,6 +4,11 @@ class EndOfTag(Exception):
 simplest way to move back up several levels in the parsing loop.'
     pass
 
+class NeedData(Exception):
+    'The fed data ran out in the middle of a token. Parsing stops there, \
+and resumes from the start of that token when more data is fed.'
+    pass
+
 # -- Validation Exceptions --
 
 class InvalidMarkup(Exception):
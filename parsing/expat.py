@@ -0,0 +1,188 @@
+import sys, re
+sys.path.append('../..')
+
+try:
+    from xml.parsers import expat as pyexpat
+    from xml.parsers.expat import model
+except ImportError:
+    pyexpat = model = None
+
+from Cassiopee.parsing.base import *
+from Cassiopee.parsing.sgml import *
+from Cassiopee.parsing.nodes import *
+from Cassiopee.parsing.scanner import ATTRIBUTE
+from Cassiopee.parsing.archives import openfile
+
+# An entity reference left in an entity value by expat
+REFERENCE = re.compile(r'&([^\s&;#]+);')
+
+# Occurrences allowed by the quantifiers of expat content models
+QUANTS = {} if model is None else {model.XML_CQUANT_NONE: (1, 1),
+                                   model.XML_CQUANT_OPT: occurs['?'],
+                                   model.XML_CQUANT_REP: occurs['*'],
+                                   model.XML_CQUANT_PLUS: occurs['+']}
+
+class ExpatBuilder:
+    '''Build a document with the pyexpat C parser instead of the parser's own
+    scanning.
+
+    The tree is made of the same nodes, through the same parser methods, but
+    the DTD is left to expat: external definitions are not read, element
+    types are recorded with their content model but without their
+    attributes (only which attributes are IDs), and nothing is validated.
+    Unlike the parser, expat does not report the white space between the
+    nodes of the prolog, which is left out of the tree.'''
+
+    def __init__(self, parser, document):
+        if pyexpat is None:
+            raise ImportError('The expat backend needs the pyexpat module.')
+        self.parser = parser
+        self.document = document
+        # The last element in the list is the one to append new elements to
+        self.ancestors = [document]
+        self.doctype = None
+        expat = self.expat = pyexpat.ParserCreate()
+        expat.buffer_text = True
+        expat.ordered_attributes = True
+        expat.StartElementHandler = self.newelement
+        expat.EndElementHandler = self.endelement
+        expat.CharacterDataHandler = self.newtext
+        expat.ProcessingInstructionHandler = self.newpi
+        expat.XmlDeclHandler = self.newxmldecl
+        expat.CommentHandler = self.newcomment
+        expat.StartDoctypeDeclHandler = self.newdoctype
+        expat.EndDoctypeDeclHandler = self.enddoctype
+        expat.EntityDeclHandler = self.newentdef
+        expat.ElementDeclHandler = self.newcmodel
+        expat.AttlistDeclHandler = self.newattlist
+
+    def feed(self, data, validate=False):
+        self.check(validate)
+        self.expat.Parse(data, False)
+
+    def close(self, validate=False):
+        self.expat.Parse(b'', True)
+
+    def parsefile(self, loc, validate=False):
+        self.check(validate)
+        if self.document.lazy:
+            raise ValueError('The expat backend does not parse lazily.')
+        with openfile(loc) as file:
+            self.expat.ParseFile(file)
+
+    def check(self, validate):
+        if validate:
+            raise ValueError('The expat backend does not validate.')
+        if self.document.source is not None:
+            raise ValueError('The expat backend does not track spans.')
+
+    def newelement(self, name, attrs):
+        self.parser.openelement(name, self.ancestors)
+        new = self.ancestors[-1]
+        names = self.parser.names
+        # Set before the ID of the element is indexed, as by the parser.
+        for i in range(0, len(attrs), 2):
+            key = names(attrs[i])
+            new.attrs[key.text] = Attribute(key, Text(attrs[i+1]))
+
+    def endelement(self, name):
+        self.parser.closeelement(name, None, self.ancestors)
+
+    def newtext(self, data):
+        if self.document.strip and data.isspace() and\
+           self.parser.ignorable(self.ancestors):
+            return
+        self.parser.newtext(self.ancestors, data)
+
+    def newpi(self, target, data):
+        names = self.parser.names
+        new = ProcessingInstruction(names(target), self.ancestors[-1])
+        for attr in ATTRIBUTE.finditer(data):
+            value = attr.group(2)
+            new.append(Attribute(names(attr.group(1))))
+            new[-1].value(Text(attr.group(3) if value is None else value))
+        self.ancestors[-1].append(new)
+
+    def newxmldecl(self, version, encoding, standalone):
+        # The XML declaration is kept as a P.I., like the parser does.
+        data = 'version="{}"'.format(version)
+        if encoding:
+            data += ' encoding="{}"'.format(encoding)
+        if standalone != -1:
+            data += ' standalone="{}"'.format('yes' if standalone else 'no')
+        self.newpi('xml', data)
+
+    def newcomment(self, data):
+        if data.startswith(' '):
+            data = data[1:]
+        self.ancestors[-1].append(MarkupComment(data))
+
+    def newdoctype(self, name, system, public, internal):
+        self.doctype = DocumentType(name, [uri for uri in (public, system)
+                                           if uri])
+
+    def enddoctype(self):
+        self.ancestors[-1].append(self.doctype)
+
+    def newcmodel(self, name, declared):
+        # Declaring any element type means that only declared ID attributes
+        # are IDs.
+        self.document.ids.setdefault(None, ('xml:id',))
+        if declared is not None:
+            content = self.cmodel(declared)
+            if isinstance(content, (Choice, Sequence)):
+                content.min, content.max = QUANTS[declared[1]]
+            self.doctype.append(ElementType(name, content))
+
+    def cmodel(self, declared):
+        '''Content model made by the parser for an expat one, which is a
+        (type, quantifier, name, parts) tuple.'''
+        kind, quant, name, parts = declared
+        if kind == model.XML_CTYPE_NAME:
+            return name
+        elif kind == model.XML_CTYPE_EMPTY:
+            return ContentRef(Empty())
+        elif kind == model.XML_CTYPE_ANY:
+            return ContentRef(Any())
+        elif kind == model.XML_CTYPE_MIXED and not parts:
+            return ContentRef(Characters())
+        elif kind == model.XML_CTYPE_SEQ:
+            content = Sequence()
+        else:
+            content = Choice()
+        if kind == model.XML_CTYPE_MIXED:
+            content.append(Characters())
+        for part in parts:
+            content.append(self.cmodel(part), *QUANTS[part[1]])
+        return content
+
+    def newattlist(self, element, name, kind, default, required):
+        self.newcmodel(element, None)
+        if kind == 'ID':
+            self.document.declareid(element, name)
+
+    def reference(self, match):
+        '''Replacement text of an entity reference, matched by REFERENCE.
+        References to unknown entities are left as they are.'''
+        name = match.group(1)
+        if name in default_entities:
+            return default_entities[name]
+        entdef = self.document.entities.get(name)
+        if entdef is not None:
+            return entdef.value.data
+        return match.group()
+
+    def newentdef(self, name, parameter, value, base, system, public,
+                  notation):
+        if value is None:
+            # External entities are not read.
+            return
+        # Expat leaves the entity references of the value as they are,
+        # where the parser replaces them.
+        value = REFERENCE.sub(self.reference, value)
+        new = EntityDefinition(name, Text(value), bool(parameter))
+        self.doctype.append(new)
+        if parameter:
+            self.document.parameters[name] = new
+        else:
+            self.document.entities[name] = new
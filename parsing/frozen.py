@@ -0,0 +1,331 @@
+import sys, gc
+from array import array
+sys.path.append('../..')
+
+from Cassiopee.parsing.base import *
+from Cassiopee.parsing.sgml import *
+from Cassiopee.parsing.nodes import *
+
+# Kinds of frozen nodes
+DOCUMENT, ELEMENT, TEXT, PI, COMMENT, DECLARATION = range(6)
+# Index standing for no node, or for no name
+NONE = -1
+
+class Frozen:
+    '''Read-only snapshot of a tree, kept column by column in arrays.
+
+    Nodes are numbered in document order, so that the descendants of a node
+    are the nodes from the one after it up to its stop. For every node, the
+    arrays hold its kind, the index of its name in names, its parent, first
+    child and next sibling, and its stop. The text of text nodes and
+    comments is joined in one string, from offsets[index] to
+    offsets[index+1]. The attributes of a node run from attrs[index] to
+    attrs[index+1] in keys, the index of their name, and limits, the end of
+    their value in the values string.
+
+    FrozenNode proxies are only made for the nodes that are looked at.'''
+
+    def __init__(self):
+        self.kinds = array('B')
+        self.nameids = array('i')
+        self.parents, self.firsts, self.nexts = array('i'), array('i'),\
+                                                array('i')
+        self.stops = array('i')
+        self.text, self.offsets = '', array('Q', [0])
+        # Names, and their index in names by qualified name
+        self.names, self.symbols = [], {}
+        self.attrs = array('i', [0])
+        self.keys = array('i')
+        self.values, self.limits = '', array('Q', [0])
+        # DTD declarations are not frozen, but kept as they are, by index
+        self.declarations = {}
+        # Pieces of text and values, until they are joined
+        self.texts, self.pieces = [], []
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __repr__(self):
+        return '<Frozen tree of ' + str(len(self)) + ' nodes at ' +\
+               hex(id(self)) + '>'
+
+    def nameid(self, name):
+        '''Index of a name in names, added if it is missing.'''
+        key = str(name)
+        if key not in self.symbols:
+            self.symbols[key] = len(self.names)
+            self.names.append(name)
+        return self.symbols[key]
+
+    def add(self, node, parent):
+        '''Append a node, without its children, and return its index.'''
+        index = len(self.kinds)
+        if isinstance(node, Text):
+            kind, data = TEXT, node.data
+        elif isinstance(node, Element):
+            kind, data = ELEMENT, ''
+        elif isinstance(node, ProcessingInstruction):
+            kind, data = PI, ''
+        elif isinstance(node, MarkupComment):
+            kind, data = COMMENT, node.content
+        elif isinstance(node, SGML):
+            kind, data = DECLARATION, ''
+            self.declarations[index] = node
+        else:
+            kind, data = DOCUMENT, ''
+        self.kinds.append(kind)
+        if kind in (ELEMENT, PI):
+            self.nameids.append(self.nameid(node.name))
+        else:
+            self.nameids.append(NONE)
+        self.parents.append(parent)
+        self.firsts.append(NONE)
+        self.nexts.append(NONE)
+        self.stops.append(index + 1)
+        self.texts.append(data)
+        self.offsets.append(self.offsets[-1] + len(data))
+        if kind == ELEMENT:
+            attrs = node.attrs.values()
+        elif kind == PI:
+            attrs = node
+        else:
+            attrs = ()
+        for attr in attrs:
+            self.keys.append(self.nameid(attr.name))
+            value = attr.value()
+            value = value.data if isinstance(value, Text) else str(value)
+            self.pieces.append(value)
+            self.limits.append(self.limits[-1] + len(value))
+        self.attrs.append(len(self.keys))
+        return index
+
+    def node(self, index):
+        '''Proxy for the node at index.'''
+        return FrozenNode(self, index)
+
+    @property
+    def root(self):
+        return FrozenNode(self, 0)
+
+    def select(self, cond):
+        '''Turn a condition on a node, or the name of the elements to
+        match, into a condition on a node index.'''
+        if isinstance(cond, (str, Name)):
+            ids = set(i for i, name in enumerate(self.names) if name == cond)
+            nameids = self.nameids
+            return lambda index: nameids[index] in ids
+        return lambda index: cond(FrozenNode(self, index))
+
+    def find(self, index, cond=lambda x: True, walk=0):
+        '''Return the index of the matching nodes under the one at index.'''
+        match = self.select(cond)
+        if walk < 0:
+            # Every descendant, in document order.
+            for kid in range(index + 1, self.stops[index]):
+                if match(kid):
+                    yield kid
+            return
+        kid = self.firsts[index]
+        while kid != NONE:
+            if match(kid):
+                yield kid
+            if walk:
+                yield from self.find(kid, cond, walk - 1)
+            kid = self.nexts[kid]
+
+    def thaw(self, index=0, names=None):
+        '''Build the node at index again, with its descendants, as plain
+        nodes. With a Names table, the names are interned in it.'''
+        if names is not None:
+            symbols = [names(str(name)) for name in self.names]
+        else:
+            symbols = self.names
+        kinds, nameids, parents = self.kinds, self.nameids, self.parents
+        text, offsets = self.text, self.offsets
+        attrs, keys = self.attrs, self.keys
+        values, limits = self.values, self.limits
+        nodes = [None] * (self.stops[index] - index)
+        # The cyclic garbage collector would go through all the new nodes
+        # again and again, though none of them can be garbage yet.
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            for i in range(index, self.stops[index]):
+                kind = kinds[i]
+                parent = nodes[parents[i] - index] if i > index else None
+                if kind == TEXT:
+                    node = Text(text[offsets[i]:offsets[i+1]])
+                elif kind == ELEMENT:
+                    node = Element(symbols[nameids[i]], parent)
+                    for j in range(attrs[i], attrs[i+1]):
+                        name = symbols[keys[j]]
+                        node.attrs[str(name)] = Attribute(name, Text(
+                            values[limits[j]:limits[j+1]]))
+                elif kind == PI:
+                    node = ProcessingInstruction(symbols[nameids[i]], parent)
+                    for j in range(attrs[i], attrs[i+1]):
+                        list.append(node, Attribute(symbols[keys[j]], Text(
+                            values[limits[j]:limits[j+1]])))
+                elif kind == COMMENT:
+                    node = MarkupComment(text[offsets[i]:offsets[i+1]])
+                elif kind == DECLARATION:
+                    node = self.declarations[i]
+                else:
+                    node = Document()
+                nodes[i - index] = node
+                if parent is not None:
+                    list.append(parent, node)
+        finally:
+            if collecting:
+                gc.enable()
+        return nodes[0]
+
+    def filter(self, cond=lambda x: True, walk=0):
+        return self.root.filter(cond, walk)
+
+    def children(self, cond=lambda x: True, walk=0):
+        return self.root.children(cond, walk)
+
+class FrozenNode:
+    '''Node of a Frozen tree, read out of its arrays when asked for.'''
+
+    __slots__ = ('tree', 'index')
+
+    def __init__(self, tree, index):
+        self.tree = tree
+        self.index = index
+
+    def __repr__(self):
+        return '<Frozen node ' + str(self.name) + ' at ' + str(self.index) +\
+               '>'
+
+    def __eq__(self, other):
+        return isinstance(other, FrozenNode) and other.tree is self.tree and\
+               other.index == self.index
+
+    def __hash__(self):
+        return hash((id(self.tree), self.index))
+
+    @property
+    def kind(self):
+        return self.tree.kinds[self.index]
+
+    @property
+    def name(self):
+        nameid = self.tree.nameids[self.index]
+        if nameid == NONE:
+            return None
+        return self.tree.names[nameid]
+
+    @property
+    def text(self):
+        '''Character data of a text node or comment, as it was read.'''
+        tree = self.tree
+        return tree.text[tree.offsets[self.index]:tree.offsets[self.index+1]]
+
+    def __str__(self):
+        if self.kind == TEXT:
+            return SPACES.sub(' ', self.text)
+        return self.text
+
+    @property
+    def declaration(self):
+        '''The DTD declaration, for declaration nodes.'''
+        return self.tree.declarations.get(self.index)
+
+    @property
+    def parent(self):
+        parent = self.tree.parents[self.index]
+        if parent == NONE:
+            return None
+        return FrozenNode(self.tree, parent)
+
+    @property
+    def attrs(self):
+        '''Values of the attributes, by qualified name.'''
+        tree = self.tree
+        return {str(tree.names[tree.keys[i]]):
+                tree.values[tree.limits[i]:tree.limits[i+1]]
+                for i in range(tree.attrs[self.index],
+                               tree.attrs[self.index + 1])}
+
+    def get(self, name, default=None):
+        '''Value of an attribute, or default if there is none by that
+        name.'''
+        tree = self.tree
+        for i in range(tree.attrs[self.index], tree.attrs[self.index + 1]):
+            if tree.names[tree.keys[i]] == name:
+                return tree.values[tree.limits[i]:tree.limits[i+1]]
+        return default
+
+    def __iter__(self):
+        tree = self.tree
+        kid = tree.firsts[self.index]
+        while kid != NONE:
+            yield FrozenNode(tree, kid)
+            kid = tree.nexts[kid]
+
+    def __len__(self):
+        return sum(1 for kid in self.tree.find(self.index))
+
+    def __getitem__(self, index):
+        if isinstance(index, (tuple, list)):
+            current = self
+            for level in index:
+                current = current[level]
+            return current
+        elif isinstance(index, (str, Name)):
+            return list(self.filter(index, -1))
+        return list(self)[index]
+
+    def filter(self, cond=lambda x: True, walk=0):
+        '''Return the matching nodes. A name matches the elements called
+        so.'''
+        for index in self.tree.find(self.index, cond, walk):
+            yield FrozenNode(self.tree, index)
+
+    def children(self, cond=lambda x: True, walk=0):
+        '''Filter for child elements.'''
+        kinds = self.tree.kinds
+        for index in self.tree.find(self.index, cond, walk):
+            if kinds[index] == ELEMENT:
+                yield FrozenNode(self.tree, index)
+
+    def ancestors(self, cond=lambda x: True, walk=-1):
+        '''Filter for ancestors.'''
+        match = self.tree.select(cond)
+        parents = self.tree.parents
+        index = parents[self.index]
+        while index != NONE and walk != 0:
+            walk -= 1
+            if match(index):
+                yield FrozenNode(self.tree, index)
+            index = parents[index]
+
+def freeze(tree):
+    '''Take a Frozen snapshot of a tree (a Document or any Node).'''
+    frozen = Frozen()
+    frozen.add(tree, NONE)
+    # Nodes being filled, with the children left to add and the last one
+    # added.
+    stack = []
+    if frozen.kinds[0] in (DOCUMENT, ELEMENT):
+        stack.append((0, iter(tree), NONE))
+    while stack:
+        parent, kids, last = stack[-1]
+        for kid in kids:
+            index = frozen.add(kid, parent)
+            if last == NONE:
+                frozen.firsts[parent] = index
+            else:
+                frozen.nexts[last] = index
+            stack[-1] = parent, kids, index
+            if frozen.kinds[index] in (DOCUMENT, ELEMENT):
+                stack.append((index, iter(kid), NONE))
+            break
+        else:
+            frozen.stops[parent] = len(frozen)
+            stack.pop()
+    frozen.text, frozen.texts = ''.join(frozen.texts), []
+    frozen.values, frozen.pieces = ''.join(frozen.pieces), []
+    return frozen
@@ -0,0 +1,138 @@
+import sys, os, re, mmap, json
+from array import array
+sys.path.append('../..')
+
+from Cassiopee.parsing.batch import parse_chunk
+
+# Markup that changes the depth, or hides tags from it: comments, P.I.s,
+# CDATA sections and declarations, internal DTD subset included.
+MARKUP = re.compile(rb'<!--.*?-->|<\?.*?\?>|<!\[CDATA\[.*?\]\]>|'
+                    rb'<![^\[>]*(?:\[.*?\]\s*)?>|'
+                    rb'<(/?)([^\s/>]+)((?:[^>"\']|"[^"]*"|\'[^\']*\')*?)(/?)>',
+                    re.DOTALL)
+# An attribute in a start tag.
+ATTRIBUTE = re.compile(rb'([^\s=]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\')')
+# Version of the sidecar format.
+VERSION = 1
+
+class Index:
+    '''Byte offsets and lengths of the children of the root element of a
+    file, with the values of some of their attributes, kept in a sidecar
+    file next to it (with an .idx suffix added).
+
+    The sidecar is rebuilt whenever the size or the modification time of
+    the file changes. Single children are then parsed without reading the
+    rest of the file.'''
+
+    def __init__(self, path, attrs=('id',)):
+        self.path = os.path.abspath(str(path))
+        self.sidecar = self.path + '.idx'
+        self.attrs = tuple(attrs)
+        # End of the root start tag, where the children start
+        self.head = 0
+        self.offsets, self.lengths = array('Q'), array('Q')
+        # For each attribute, the child holding each value
+        self.values = {attr: {} for attr in self.attrs}
+        # Entity definitions of the prolog, once parsed
+        self.prolog = None
+        if not self.read():
+            self.build()
+            self.write()
+
+    def stamp(self):
+        stat = os.stat(self.path)
+        return stat.st_size, stat.st_mtime_ns
+
+    def read(self):
+        '''Load the sidecar, if it is still valid for the file.'''
+        try:
+            with open(self.sidecar, 'rb') as file:
+                header = json.loads(file.readline().decode())
+                if header['version'] != VERSION or\
+                   tuple(header['stamp']) != self.stamp() or\
+                   not set(self.attrs) <= set(header['values']):
+                    return False
+                self.offsets.frombytes(file.read(8 * header['count']))
+                self.lengths.frombytes(file.read(8 * header['count']))
+        except (OSError, ValueError, KeyError):
+            return False
+        self.head = header['head']
+        self.values = header['values']
+        return True
+
+    def write(self):
+        header = {'version': VERSION, 'stamp': self.stamp(),
+                  'head': self.head, 'count': len(self.offsets),
+                  'values': self.values}
+        with open(self.sidecar, 'wb') as file:
+            file.write(json.dumps(header).encode() + b'\n')
+            file.write(self.offsets.tobytes())
+            file.write(self.lengths.tobytes())
+
+    def build(self):
+        '''Scan the file for the children of its root element.'''
+        self.offsets, self.lengths = array('Q'), array('Q')
+        self.values = {attr: {} for attr in self.attrs}
+        wanted = {attr.encode() for attr in self.attrs}
+        depth = 0
+        with open(self.path, 'rb') as file:
+            if not os.fstat(file.fileno()).st_size:
+                return
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                for tag in MARKUP.finditer(data):
+                    if tag.group(2) is None:
+                        continue
+                    closing, name, attrs, empty = tag.groups()
+                    if closing:
+                        depth -= 1
+                        if depth == 1:
+                            self.lengths.append(tag.end() - start)
+                        continue
+                    if depth == 0:
+                        self.head = tag.end()
+                    elif depth == 1:
+                        start = tag.start()
+                        self.offsets.append(start)
+                        if empty:
+                            self.lengths.append(tag.end() - start)
+                        for attr in ATTRIBUTE.finditer(attrs):
+                            if attr.group(1) in wanted:
+                                value = attr.group(2)
+                                if value is None:
+                                    value = attr.group(3)
+                                self.values[attr.group(1).decode()]\
+                                    [value.decode()] = len(self.offsets) - 1
+                    if not empty:
+                        depth += 1
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, index):
+        '''Parse the child at index, and return its nodes.'''
+        if self.prolog is None:
+            # The entities of the prolog are read once, from the head.
+            from Cassiopee.parsing import Parser, Document
+            parser = Parser()
+            document = Document(self.path, parser)
+            with open(self.path, 'rb') as file:
+                document.feed(file.read(self.head))
+            self.prolog = document.entities, document.parameters
+        start = self.offsets[index]
+        return parse_chunk(self.path, start, start + self.lengths[index],
+                           *self.prolog)
+
+    def find(self, attr, value):
+        '''Return the index of the child whose attribute has that value.'''
+        return self.values[attr][value]
+
+    def get(self, attr, value):
+        '''Parse the child whose attribute has that value.'''
+        for node in self[self.find(attr, value)]:
+            if hasattr(node, 'name'):
+                return node
+
+    def __repr__(self):
+        return '<Index of {} children of {} at {}>'.format(len(self),
+                                                           self.path,
+                                                           hex(id(self)))
@@ -1,164 +1,327 @@
-class LightParser(Node):
+import sys, re
+sys.path.append('../..')
+
+from Cassiopee.parsing.base import *
+from Cassiopee.parsing.scanner import *
+from Cassiopee.parsing.archives import openfile
+
+# An internal entity definition, as found between '<!ENTITY' and '>'.
+ENTITY_DEF = re.compile(r'(%\s+)?([^\s"\']+)\s+(?:"([^"]*)"|\'([^\']*)\')')
+# A quoted literal in a declaration, like the locations of a DOCTYPE.
+LITERAL = re.compile(r'"([^"]*)"|\'([^\']*)\'')
+# Markup that matters inside a generic declaration, with the quotes around
+# its literals, which can hold any of it.
+DECL_QUOTE = re.compile(r'[\[>%"\']')
+# A character or entity reference, in an entity value.
+REFERENCE = re.compile(r'&([^\s&;]+);')
+
+class LightParser:
+    '''Streaming XML parser, which reports what it reads instead of building
+    a tree, so that its memory use does not grow with the document.
+
+    Events are (event, name, value) tuples. The event is one of:
+        'start':    an element is opened, value is a dict of its attributes,
+        'end':      an element is closed, value is None,
+        'text':     character data, name is None and value the text,
+        'pi':       a processing instruction, value is a dict of attributes,
+        'comment':  a comment, name is None and value the comment,
+        'decl':     an SGML declaration, value is its raw content.
+    Calling the parser hands every event to the matching *_handler method,
+    while events() yields them one by one.'''
 
     def __init__(self, xmlfile=None):
-        super().__init__()
         self.tags = {'!': self.newdecl,
                      '?': self.newpi,
                      '/': self.endelement}
+        self.decls = {'--': self.newcomment}
+        # Symbol table, so that an element's events share its Name
+        self.names = Names()
+        self.handlers = {'start': self.newelement_handler,
+                         'end': self.endelement_handler,
+                         'text': self.newtext_handler,
+                         'pi': self.newpi_handler,
+                         'comment': self.newcomment_handler,
+                         'decl': self.newdecl_handler}
         if xmlfile: self(xmlfile)
 
-    def newtag(self, stream, ancestors=[], validate=False):
-        char = next(stream)
-        if char in self.tags:
-            self.tags[char](stream, ancestors, validate)
-        else:
-            self.newelement(stream, char, ancestors, validate)
+    # == Event handlers, to be overridden ==
+    def newelement_handler(self, name, attrs):
+        pass
 
-    def newelement_handler(self, name, ancestors=[], validate=False):
+    def endelement_handler(self, name, value=None):
         pass
 
-    def newelement(self, stream, data, ancestors=[], validate=False):
-        space, name = '', ''
-        keyspace = ''
-        for char in stream:
-            if char == ':':
-                if not name: space = data
-                else: keyspace = data
-                data = ''
-            elif char == ' ' and not name:
-                name, data = Name(data, space), ''
-                self.newelement_handler(name, ancestors, validate)
-            elif char == '=':
-                name, data = Name(data, keyspace), ''
-                self.newattr(stream, name, ancestors, validate)
-            elif char == '/':
-                self.endelement(stream, ancestors, validate)
+    def newtext_handler(self, name, text):
+        pass
+
+    def newpi_handler(self, name, attrs):
+        pass
+
+    def newcomment_handler(self, name, text):
+        pass
+
+    def newdecl_handler(self, name, content):
+        pass
+
+    # == Scanning ==
+    def newtag(self, stream):
+        char = next(stream, '')
+        if char in self.tags:
+            yield from self.tags[char](stream)
+        else:
+            yield from self.newelement(stream, char)
+
+    def newelement(self, stream, data):
+        # Most tags are read whole, in one match.
+        tag = stream.match(START_TAG)
+        if tag:
+            name, attributes, closed = tag.groups()
+            name = self.names(data + name)
+            attrs = {}
+            for attr in ATTRIBUTE.finditer(attributes):
+                value = attr.group(2)
+                attrs[attr.group(1)] = attr.group(3) if value is None\
+                                                     else value
+            yield 'start', name, attrs
+            if closed:
+                yield 'end', name, None
+            return
+        # Otherwise, the name and attributes are scanned one by one.
+        name = self.names(data + stream.until(NAME_END))
+        attrs = {}
+        while True:
+            char = stream.skip()
+            if char in ('>', ''):
+                next(stream, '')
+                yield 'start', name, attrs
                 break
-            elif char == '>' and not name:
-                name, data = Name(data, space), ''
-                self.newelement_handler(name, ancestors, validate)
+            elif char == '/':
+                stream.upto('>')
+                yield 'start', name, attrs
+                yield 'end', name, None
                 break
-            else:
-                data += char
+            key = stream.until(NAME_END)
+            if stream.skip() == '=':
+                next(stream)
+                attrs[key] = self.newattr(stream)
 
-    def endelement_handler(self, name, ancestors=[], validate=False):
-        pass
+    def endelement(self, stream):
+        yield 'end', self.names(stream.upto('>').strip()), None
 
-    def endelement(self, stream, ancestors=[], validate=False):
-        data, space, name = '', '', ''
-        for char in stream:
-            if char == ':': space, data = data, ''
-            elif char == '>':
-                name, data = Name(name, space), ''
-                self.endelement_handler(name, ancestors, validate)
+    def newpi(self, stream):
+        name = self.names(stream.until(PI_END))
+        attrs = {}
+        while True:
+            char = stream.skip()
+            if char in ('?', ''):
+                # Oh, we reached the end of the P.I.
+                stream.upto('>')
                 break
-            else:
-                data += char
+            key = stream.until(PI_END)
+            if stream.skip() == '=':
+                next(stream)
+                attrs[key] = self.newattr(stream)
+        yield 'pi', name, attrs
 
-    def newpi_handler(self, name, ancestors=[], validate=False):
-        pass
+    def newattr(self, stream):
+        # There may be spaces before the quote, so we just ignore them.
+        stream.until(QUOTE)
+        return self.newstr(stream, next(stream, '"'))
 
-    def endpi_handler(self, name, ancestors=[], validate=False):
-        pass
+    def newstr(self, stream, quote='"'):
+        data = []
+        while True:
+            data.append(stream.until(STRING_END[quote]))
+            if next(stream, quote) == quote:
+                return ''.join(data)
+            data.append(self.newentref(stream))
 
-    def newpi(self, stream, ancestors=[], validate=False):
-        data, name = '', ''
-        for char in stream:
-            if char == ' ' and not name:
-                name, data = Name(data), ''
-                self.newpi_handler(name, ancestors, validate)
-            elif char == '=':
-                name, data = Name(data), ''
-                self.newattr(stream, name, ancestors, validate)
-            elif char == '?':
-                for char in stream: if char == '>': break
-                if not name:
-                    name, data = Name(name), ''
-                    self.newpi_handler(name, ancestors, validate)
-                self.endpi_handler(name, ancestors, validate)
-            else:
-                data += char
+    def newentref(self, stream):
+        return self.reference(stream.upto(';'))
 
-    def newstr(self, stream, ancestors=[], validate=False):
-        pass
+    def reference(self, name):
+        '''Replacement text of a reference to a character or an entity.'''
+        if name in default_entities:
+            return default_entities[name]
+        elif name.startswith('#x'):
+            return chr(int(name[2:], 16))
+        elif name.startswith('#'):
+            return chr(int(name[1:]))
+        return self.entity(name)
 
-    def newtext(self, stream, text, ancestors=[], validate=False):
-        pass
+    def entity(self, name):
+        '''Replacement text of a named entity. Unknown entities are left as
+        they are.'''
+        return '&' + name + ';'
 
-    def newentref(self, stream, ancestors=[], validate=False):
-        pass
+    def newdecl(self, stream):
+        if stream.peek() == '-':
+            # Comments do not need a space after their opening dashes.
+            keyword = next(stream) + next(stream, '')
+        else:
+            keyword = stream.until(DECL_END)
+        yield from self.decls.get(keyword, self.newmarkup)(stream, keyword)
 
-    def newattr(self, stream, name, ancestors=[], validate=False):
-        self.newattr_handler(name, ancestors, validate)
-        pass
+    def newcomment(self, stream, keyword='--'):
+        data = stream.upto('-->')
+        if data.startswith(' '):
+            data = data[1:]
+        if data.endswith(' '):
+            data = data[:-1]
+        yield 'comment', None, data
 
-    def newdecl(self, stream, ancestors=[], validate=False):
-        pass
+    def newmarkup(self, stream, keyword):
+        content = []
+        while True:
+            content.append(stream.until(DECL_QUOTE))
+            char = next(stream, '')
+            if char == '%':
+                content.append(char)
+            elif char in ('"', '\''):
+                content.append(char + stream.upto(char) + char)
+            elif char == '[':
+                # Inline definitions come after their declaration.
+                yield 'decl', keyword, ''.join(content).strip()
+                yield from self.declcontent(stream)
+                stream.upto('>')
+                return
+            else:
+                break
+        yield 'decl', keyword, ''.join(content).strip()
+
+    def declcontent(self, stream):
+        while True:
+            stream.until(DTD_MARK)
+            char = next(stream, '')
+            if char in (']', ''):
+                break
+            elif char == '%':
+                # Parameter entities are not expanded.
+                stream.upto(';')
+            else:
+                char = next(stream, '')
+                if char == '!':
+                    yield from self.newdecl(stream)
+                elif char == '?':
+                    yield from self.newpi(stream)
 
-    def __call__(self, loc, validate=False):
-        if len(self): self.empty()
-        data, ancestors = '', [self]
-        stream = FileCopy(loc)
-        for char in stream:
+    def parse(self, stream):
+        '''Generate the events read from a Scanner.'''
+        while True:
+            data = [stream.until(TEXT_END)]
+            char = next(stream, '')
+            # Entity references are merged with the surrounding text.
+            while char == '&':
+                data.append(self.newentref(stream))
+                data.append(stream.until(TEXT_END))
+                char = next(stream, '')
+            data = ''.join(data)
+            if data:
+                yield 'text', None, data
             if char == '<':
-                self.newtext(stream, data, ancestors, validate)
-                self.newtag(stream, ancestors, validate)
-            elif char == '&':
-                self.newtext(stream, data, ancestors, validate)
-                self.newentref(stream, ancestors, validate)
-                data = ''
+                yield from self.newtag(stream)
             else:
-                data += char
+                break
 
-    def __repr__(self):
-        return '<XML Parser at ' + hex(id(self)) + '>'
+    def events(self, loc):
+        '''Generate the events of the file at loc.'''
+        with openfile(loc) as file:
+            yield from self.parse(Scanner(file))
 
-    def __str__(self):
-        mask = lambda x: str(x) not in ('\n', ' ') if isinstance(x, Text)\
-                                                   else True
-        escape = lambda x: x.escape() if isinstance(x, Text) else x
-        return '\n'.join(str(escape(node)) for node in self.filter(mask))
+    def __call__(self, loc):
+        handlers = self.handlers
+        for event, name, value in self.events(loc):
+            handlers[event](name, value)
+
+    def __repr__(self):
+        return '<Light XML Parser at ' + hex(id(self)) + '>'
 
 
 class SGMLParser(LightParser):
+    '''Streaming parser which also reads the internal entity definitions,
+    and expands references to them.'''
 
     def __init__(self, xmlfile=None):
-        self.decls = {'ELEMENT': self.newcmodel,
-                      'DOCTYPE': self.newdoctype,
-                      'ATTLIST': self.newattlist,
-                      'ENTITY': self.newentdef,
-                      '--': self.newcomment}
+        # General and parameter entities, by name.
+        self.entities, self.parameters = {}, {}
         super().__init__(xmlfile)
+        self.decls['ENTITY'] = self.newentdef
 
-    def newdecl(self, stream, ancestors=[], validate=False):
-        pass
-
-    def newcomment(self, stream, ancestors=[], validate=False):
-        pass
+    def newentdef(self, stream, keyword='ENTITY'):
+        for event in self.newmarkup(stream, keyword):
+            definition = ENTITY_DEF.match(event[2])
+            if definition:
+                system, name, value, other = definition.groups()
+                value = other if value is None else value
+                # References in the value are replaced once and for all.
+                value = REFERENCE.sub(lambda ref: self.reference(ref.group(1)),
+                                      value)
+                if system:
+                    self.parameters[name] = value
+                else:
+                    self.entities[name] = value
+            yield event
 
-    def newdoctype(self, stream, ancestors=[], validate=False):
-        pass
+    def entity(self, name):
+        return self.entities.get(name, '&' + name + ';')
 
-    def dtdfile(self, stream, ancestors=[], validate=False):
-        pass
+    def events(self, loc):
+        self.entities.clear()
+        self.parameters.clear()
+        yield from super().events(loc)
 
-    def newcmodel(self, stream, ancestors=[], validate=False):
-        pass
-
-    def defkids(self, stream, ancestors=[], validate=False):
-        pass
 
-    def newattlist(self, stream, ancestors=[], validate=False):
-        pass
+class Head:
+    '''What the start of a document tells about the resources it needs.'''
 
-    def defattrs(self, stream, ancestors=[], validate=False):
-        pass
+    def __init__(self):
+        # Name of the root element, and locations of the document type
+        # (public identifier first), if there is a DOCTYPE
+        self.doctype, self.location = None, []
+        # Attributes of the <link> and <meta> elements, in document order
+        self.links, self.metas = [], []
+        # Processing instructions, as (name, attributes) pairs
+        self.pis = []
 
-    def newentdef(self, stream, ancestors=[], validate=False):
-        pass
+    def __repr__(self):
+        return '<Head of {} with {} links at {}>'.format(self.doctype,
+                                                         len(self.links),
+                                                         hex(id(self)))
 
-    def newsysentref(self, stream, ancestors=[], valdiate=False):
-        pass
+def prescan(loc):
+    '''Read only the head of the document at loc: its prolog, and the
+    <head> element of an HTML document, and return a Head.
 
-    def declcontent(self, stream, ancestors=[], file=False, validate=False):
-        pass
+    Scanning stops at the root start tag, or for HTML at the end of the
+    head or the start of the body, so that the resources of the document
+    can be fetched before it is parsed whole.'''
+    head, root = Head(), None
+    events = LightParser().events(loc)
+    try:
+        for event, name, value in events:
+            if event == 'decl' and name == 'DOCTYPE':
+                head.doctype = value.split(None, 1)[0] if value else None
+                for uri in LITERAL.finditer(value):
+                    double = uri.group(1)
+                    head.location.append(uri.group(2) if double is None
+                                         else double)
+            elif event == 'pi':
+                head.pis.append((name, value))
+            elif event == 'start':
+                tag = name.name.lower()
+                if root is None:
+                    # Only HTML documents are read past their root start tag.
+                    root = tag
+                    if tag != 'html':
+                        break
+                elif tag == 'link':
+                    head.links.append(value)
+                elif tag == 'meta':
+                    head.metas.append(value)
+                elif tag == 'body':
+                    break
+            elif event == 'end' and name.name.lower() in ('head', 'html'):
+                break
+    finally:
+        events.close()
+    return head
@@ -1,11 +1,15 @@
-import sys
+import sys, heapq, functools
 sys.path.append('../..')
 
 from Cassiopee.parsing.base import *
+from Cassiopee.parsing.sgml import DocumentType, ElementType
+from Cassiopee.parsing.archives import openfile
 
 # == XML Elements, Attributes & Processing Instructions ==
 class ProcessingInstruction(Node):
 
+    __slots__ = ()
+
     def __init__(self, name, parent=None):
         self.name = name
         self.parent = parent
@@ -23,30 +27,74 @@ class ProcessingInstruction(Node):
         return '<?{}{}?>'.format(self.name, attributes)
 
 class Element(Node):
+    '''XML element, whose children are its content, and whose attributes
+    are kept apart in attrs, by name, in document order.'''
+
+    __slots__ = ('start', 'stop', 'attrs')
 
     def __init__(self, name, parent=None):
-        super().__init__()
+        # Node.__init__ is not called, since it only gives a default name.
         self.name = name
         self.parent = parent
+        # Offsets of the element in the source text, from its start tag to
+        # the end of its end tag, when the document keeps its source
+        self.start, self.stop = None, None
+        # Attribute nodes, by their qualified name
+        self.attrs = {}
+
+    def get(self, name, default=None):
+        '''Value of an attribute, or default if the element has none by that
+        name.'''
+        attr = self.attrs.get(str(name))
+        if attr is None:
+            return default
+        return attr.value()
+
+    def set(self, name, value):
+        '''Give a value to an attribute, adding it if it is missing.'''
+        name = str(name)
+        document = self.top()
+        # The name is shared with the others of the parser, if there is one.
+        parser = getattr(document, 'parser', None)
+        if parser is not None:
+            key = parser.names(name)
+        else:
+            space, _, local = name.rpartition(':')
+            key = Name(local, space)
+        indexes = getattr(document, 'indexes', None)
+        if indexes is not None:
+            indexes.dropid(self)
+        self.attrs[name] = Attribute(key, Text(value))
+        if indexes is not None:
+            indexes.addid(self)
+
+    def addattr(self, attr):
+        '''Add an Attribute node, replacing any of the same name.'''
+        indexes = getattr(self.top(), 'indexes', None)
+        if indexes is not None:
+            indexes.dropid(self)
+        self.attrs[str(attr.name)] = attr
+        if indexes is not None:
+            indexes.addid(self)
+
+    @property
+    def nodes(self):
+        '''The attributes and children of the element, as they were listed
+        when attributes were child nodes.'''
+        return Nodes(self)
 
     def __repr__(self):
         return '<XML Element ' + self.name.name + ' at ' + hex(id(self)) + '>'
 
     def __str__(self):
-        attrs = [i for i in self.filter(lambda x: isinstance(x, Attribute))]
-        if attrs:
+        if self.attrs:
             attributes = ' ' + ' '.join('{}="{}"'.format(attr.name,
                                                Text(attr.value()).escape()) for\
-                                        attr in attrs)
+                                        attr in self.attrs.values())
         else:
             attributes = ''
-        def mask(x):
-            if isinstance(x, Attribute):
-                return False
-            elif isinstance(x, Text) and str(x) in (' ', '\n'):
-                return False
-            else:
-                return True
+        mask = lambda x: str(x) not in (' ', '\n') if isinstance(x, Text)\
+                                                 else True
         escape = lambda x: x.escape() if isinstance(x, Text) else x
         kids = [escape(i) for i in self.filter(mask)]
         if kids:
@@ -58,8 +106,98 @@ class Element(Node):
         else:
             return '<{}{}/>'.format(str(self.name), attributes)
 
+class Nodes:
+    '''Read-only view of an element's attributes followed by its children.
+
+    It stands for the element in code that looks for Attribute nodes among
+    the children.'''
+
+    __slots__ = ('element',)
+
+    def __init__(self, element):
+        self.element = element
+
+    def __iter__(self):
+        yield from self.element.attrs.values()
+        yield from self.element
+
+    def __len__(self):
+        return len(self.element.attrs) + len(self.element)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self)[index]
+        count = len(self.element.attrs)
+        if index < 0:
+            index += len(self)
+        if 0 <= index < count:
+            return list(self.element.attrs.values())[index]
+        elif index < 0:
+            raise IndexError('index out of range')
+        return self.element[index - count]
+
+    def filter(self, cond=lambda x: True):
+        '''Return the matching nodes.'''
+        for node in self:
+            if cond(node):
+                yield node
+
+class LazyElement(Element):
+    '''Element whose content is only parsed when it is first accessed.'''
+
+    __slots__ = ('document', 'span')
+
+    def __init__(self, name, parent=None, document=None):
+        super().__init__(name, parent)
+        # Document holding the element
+        self.document = document
+        # Byte offsets of the content in the source, until it is parsed
+        self.span = None
+
+    def load(self):
+        '''Parse the content of the element, if it was not yet.'''
+        if self.span is None:
+            return
+        start, stop = self.span
+        self.span = None
+        with openfile(self.document.base) as file:
+            file.seek(start)
+            data = file.read(stop - start)
+        parser = self.document.parser
+        builder = parser.builder(parser, self.document)
+        # The content is read at its real depth, under the element.
+        builder.ancestors[1:] = list(self.ancestors())[-2::-1] + [self]
+        # It is indexed once parsed, since it comes before elements that
+        # already are.
+        indexes, self.document.indexes = self.document.indexes, None
+        try:
+            builder.feed(data)
+            builder.close()
+        finally:
+            self.document.indexes = indexes
+        if indexes is not None:
+            indexes.add(list.__iter__(self), self)
+
+    def __getitem__(self, index):
+        self.load()
+        return super().__getitem__(index)
+
+    def __iter__(self):
+        self.load()
+        return super().__iter__()
+
+    def __len__(self):
+        self.load()
+        return super().__len__()
+
+    def find(self, cond=lambda x: True, walk=0):
+        self.load()
+        return super().find(cond, walk)
+
 class Attribute(Node):
 
+    __slots__ = ('__value',)
+
     def __init__(self, name, value=''):
         self.name = name
         self.__value = value
@@ -69,3 +207,290 @@ class Attribute(Node):
             self.__value = new
         else:
             return self.__value
+
+def lineage(node):
+    '''The ancestors of a node, from the root down, and the node.'''
+    nodes = [node]
+    while True:
+        parent = getattr(node, 'parent', None)
+        if parent is None or parent is node:
+            return nodes[::-1]
+        nodes.append(parent)
+        node = parent
+
+def precedes(first, second, position=None):
+    '''Whether the first node comes before the second in their tree.
+
+    position(parent, node) gives the index of a child among the children of
+    its parent, if there is a faster way than to look through them.'''
+    one, two = lineage(first), lineage(second)
+    depth = 0
+    while depth < len(one) and depth < len(two) and one[depth] is two[depth]:
+        depth += 1
+    if depth == 0 or depth == len(two):
+        # Other trees, or the second node holds the first one.
+        return False
+    elif depth == len(one):
+        return True
+    elif position is not None:
+        parent = one[depth - 1]
+        return position(parent, one[depth]) < position(parent, two[depth])
+    for node in list.__iter__(one[depth - 1]):
+        if node is one[depth]:
+            return True
+        elif node is two[depth]:
+            return False
+    return False
+
+class Indexes:
+    '''Elements of a document by qualified name, in document order, and by
+    the value of their ID attribute.
+
+    The parser fills them as it reads the document, and nodes keep them up
+    to date as they are appended, inserted, replaced and removed. Elements
+    are added in document order with a binary search, and removed name by
+    name. The position of the children of a parent is kept from one
+    comparison of their order to the next.'''
+
+    def __init__(self, document):
+        self.document = document
+        # Lists of elements by qualified name, and elements by ID
+        self.names, self.ids = {}, {}
+        # Qualified names by local name
+        self.locals = {}
+        # Index of the children of a parent, by id of the child, by id of
+        # the parent
+        self.positions = {}
+
+    def run(self, name):
+        '''The list of the elements of a qualified name, made if missing.'''
+        found = self.names.get(name)
+        if found is None:
+            found = self.names[name] = []
+            self.locals.setdefault(name.rpartition(':')[2], set()).add(name)
+        return found
+
+    def opened(self, element):
+        '''Add an element being parsed, which comes after all the others.'''
+        self.run(str(element.name)).append(element)
+
+    def position(self, parent, node):
+        '''Index of node among the children of parent.'''
+        order = self.positions.setdefault(id(parent), {})
+        index = order.get(id(node))
+        count = len(parent)
+        if index is None:
+            # Children appended since the last time are numbered.
+            for i in range(min(len(order), count), count):
+                order[id(list.__getitem__(parent, i))] = i
+            index = order.get(id(node))
+        if index is None or index >= count or\
+           list.__getitem__(parent, index) is not node:
+            # The children moved, and are numbered again.
+            order.clear()
+            for i, kid in enumerate(list.__iter__(parent)):
+                order[id(kid)] = i
+            index = order[id(node)]
+        return index
+
+    def precedes(self, first, second):
+        return precedes(first, second, self.position)
+
+    def addid(self, element):
+        for name in self.document.idnames(element.name):
+            if name in element.attrs:
+                value = str(element.attrs[name].value()).strip()
+                self.ids.setdefault(value, element)
+
+    def dropid(self, element):
+        for name in self.document.idnames(element.name):
+            if name in element.attrs:
+                value = str(element.attrs[name].value()).strip()
+                if self.ids.get(value) is element:
+                    del self.ids[value]
+
+    def elements(self, nodes, parent=None):
+        '''The elements among nodes and under them, in document order, made
+        children of parent if given. Content that lazy elements have not
+        loaded is not indexed yet.'''
+        for node in nodes:
+            if isinstance(node, Element):
+                if parent is not None:
+                    node.parent = parent
+                yield node
+                yield from self.elements(list.__iter__(node),
+                                         None if parent is None else node)
+
+    def add(self, nodes, parent):
+        '''Index nodes just put next to each other under parent.'''
+        runs = {}
+        for element in self.elements(nodes, parent):
+            runs.setdefault(str(element.name), []).append(element)
+            self.addid(element)
+        for name, run in runs.items():
+            # The new elements of a name come one after the other, with
+            # no other element between them.
+            found = self.run(name)
+            low, high = 0, len(found)
+            if found and self.precedes(found[-1], run[0]):
+                low = high
+            while low < high:
+                middle = (low + high) // 2
+                if self.precedes(found[middle], run[0]):
+                    low = middle + 1
+                else:
+                    high = middle
+            found[low:low] = run
+
+    def remove(self, nodes):
+        '''Forget nodes about to be taken out of the tree.'''
+        gone = {}
+        for element in self.elements(nodes):
+            gone.setdefault(str(element.name), set()).add(id(element))
+            self.dropid(element)
+            self.positions.pop(id(element), None)
+        for name, ids in gone.items():
+            self.names[name] = [element for element in self.names.get(name, [])
+                                if id(element) not in ids]
+
+    def named(self, name):
+        '''The elements called name, in document order. As when a Name is
+        compared to a string, a string without a prefix is a local name, and
+        stands for the elements of that name in any namespace.'''
+        if isinstance(name, Name) or ':' in name:
+            return self.names.get(str(name), [])
+        runs = [self.names[key] for key in self.locals.get(name, ())
+                if self.names[key]]
+        if len(runs) < 2:
+            return runs[0] if runs else []
+        order = functools.cmp_to_key(lambda one, two:
+                                     -1 if self.precedes(one, two) else 1)
+        return list(heapq.merge(*runs, key=order))
+
+    def within(self, node, name):
+        '''The elements called name under node, in document order.'''
+        found = self.named(name)
+        if node is self.document:
+            return found[:]
+        # They come after the node, and before the first element that is
+        # not under it.
+        low, high = 0, len(found)
+        while low < high:
+            middle = (low + high) // 2
+            if found[middle] is node or self.precedes(found[middle], node):
+                low = middle + 1
+            else:
+                high = middle
+        start, high = low, len(found)
+        while low < high:
+            middle = (low + high) // 2
+            if any(ancestor is node for ancestor in lineage(found[middle])):
+                low = middle + 1
+            else:
+                high = middle
+        return found[start:low]
+
+class Document(Node):
+    '''Root of a parsed XML tree.
+
+    It carries the location of its source, against which relative DTD and
+    entity references are resolved, and the state of its parse, so that a
+    single parser can work on many documents at once.'''
+
+    def __init__(self, base='', parser=None):
+        super().__init__()
+        # Location of the source document (a path or a URL)
+        self.base = str(base)
+        # Parser used by feed() and close()
+        self.parser = parser
+        # Builder of the document while it is fed, if any
+        self.pending = None
+        # Name of the elements handed over by iterparse, and those of them
+        # that were completed but not yet handed over
+        self.wanted, self.completed = None, None
+        # General and parameter entity definitions, by name
+        self.entities, self.parameters = {}, {}
+        # Depth of the elements whose content is parsed when first accessed
+        self.lazy = None
+        # Source text, kept when the elements track their spans in it
+        self.source = None
+        # Whether ignorable white space is dropped, and whether elements
+        # have mixed content, by name, once looked up in the DTD
+        self.strip, self.mixed = False, {}
+        # Indexes of the elements, when they are kept, and the names of
+        # the ID attributes of elements, by name, once looked up in the DTD
+        self.indexes, self.ids = None, {}
+
+    def feed(self, data, validate=False):
+        '''Parse a piece of the document, as a string or as encoded bytes.
+
+        The tree grows with every piece, and an unfinished token is kept
+        until the next one completes it.'''
+        if self.pending is None:
+            self.empty()
+            self.pending = self.parser.builder(self.parser, self)
+        self.pending.feed(data, validate)
+
+    def close(self, validate=False):
+        '''Finish parsing the fed document.'''
+        if self.pending is not None:
+            pending, self.pending = self.pending, None
+            pending.close(validate)
+        return self
+
+    def empty(self):
+        # The indexes are emptied along with the tree, not node by node.
+        indexes, self.indexes = self.indexes, None
+        super().empty()
+        self.entities.clear()
+        self.parameters.clear()
+        self.mixed.clear()
+        self.ids.clear()
+        if indexes is not None:
+            self.indexes = Indexes(self)
+
+    def indexelements(self):
+        '''Keep indexes of the elements by name and by ID from now on, so
+        that doc['name'] and get_by_id() need not walk the tree.'''
+        if self.indexes is None:
+            self.indexes = Indexes(self)
+            self.indexes.add(list.__iter__(self), self)
+
+    def idnames(self, name):
+        '''Names of the ID attributes of the elements called name: those
+        the DTD declares of type ID, or id without a DTD, and xml:id.'''
+        ids = self.ids
+        if None not in ids:
+            # The parsers record the ID attributes as they read the
+            # ATTLIST declarations, before or after the ELEMENT ones.
+            declared = len(ids) or any(isinstance(node, ElementType)
+                                       for doctype in self.filter(lambda x:
+                                            isinstance(x, DocumentType))
+                                       for node in doctype)
+            ids[None] = ('xml:id',) if declared else ('id', 'xml:id')
+        return ids.get(str(name), ids[None])
+
+    def declareid(self, element, attr):
+        '''Record that the attribute of the elements called element is of
+        type ID.'''
+        names = self.ids.get(element, ('xml:id',))
+        if attr not in names:
+            self.ids[element] = (attr,) + names
+
+    def get_by_id(self, value):
+        '''The element whose ID attribute has value, if any.'''
+        if self.indexes is not None:
+            return self.indexes.ids.get(value)
+        for node in self.filter(lambda x: isinstance(x, Element), -1):
+            if node.id is not None and str(node.id).strip() == value:
+                return node
+        return None
+
+    def __repr__(self):
+        return '<XML Document ' + self.base + ' at ' + hex(id(self)) + '>'
+
+    def __str__(self):
+        mask = lambda x: str(x) not in ('\n', ' ') if isinstance(x, Text)\
+                                                   else True
+        escape = lambda x: x.escape() if isinstance(x, Text) else x
+        return '\n'.join(str(escape(node)) for node in self.filter(mask))
@@ -1,6 +1,15 @@
-import sys, pathlib, time, os
+import sys, pathlib, time, os, io, mmap, codecs, stat, tempfile
+from bisect import bisect_right
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 DELAY = 1
+# Longest wait between two attempts at a lock, with a timeout.
+BACKOFF = 0.05
 
 class Stream:
     'Writable & readable file, with builtin locks and list-like access.'
@@ -12,11 +21,10 @@ class Stream:
         self.tty = tty
         self.buffsize, self.buffer, self.buffpos = buffer, '', 0
         self.mode = 'a+'
-        self.acquire()
-        with self.name.open() as file:
-            self.buffer = file.read(self.buffsize)
-            self.encoding = file.encoding
-        self.release()
+        with self.lock.shared():
+            with self.name.open() as file:
+                self.buffer = file.read(self.buffsize)
+                self.encoding = file.encoding
 
     def __iter__(self):
         return self
@@ -92,7 +100,7 @@ class Stream:
         return not bool(exc_type)
     
     def fileno(self):
-        with self.lock:
+        with self.lock.shared():
             with self.name.open() as file:
                 return file.fileno()
     
@@ -118,7 +126,7 @@ class Stream:
             self.pos = len(self) - 1 + pos
 
     def __len__(self):
-        with self.lock:
+        with self.lock.shared():
             with self.name.open() as file:
                 return len(file.read())
         return 0
@@ -151,7 +159,7 @@ class Stream:
            size == -1:
             # The cursor was placed before or after the buffer,
             # or the selection ends after the buffer.
-            with self.lock:
+            with self.lock.shared():
                 with self.name.open() as file:
                     file.seek(self.pos)
                     output = file.read(size)
@@ -166,7 +174,7 @@ class Stream:
     
     def readline(self, size=-1):
         output = ''
-        with self.lock:
+        with self.lock.shared():
             with self.name.open() as file:
                 file.seek(self.pos)
                 output = file.readline(size)
@@ -175,7 +183,7 @@ class Stream:
     
     def readlines(self, sizehint=-1):
         output = ['']
-        with self.lock:
+        with self.lock.shared():
             with self.name.open() as file:
                 file.seek(self.pos)
                 output = file.readlines(sizehint)
@@ -189,13 +197,452 @@ class Stream:
                 newsize = file.truncate(size)
         return newsize
 
+class EditableStream(Stream):
+    '''Stream whose edits are kept in memory until commit().
+
+    The text is a table of pieces, each a slice of the original text or of
+    an inserted string, so that an edit only splits the pieces around it
+    instead of rewriting the rest of the file. Reads go through the pieces,
+    and commit() writes the result out at once.'''
+
+    def __init__(self, name, tty=False):
+        self.name = pathlib.Path(name)
+        self.pos = 0
+        self.lock = Lock(name)
+        self.tty = tty
+        self.mode = 'r+'
+        with self.lock.shared():
+            with self.name.open() as file:
+                self.reset(file.read())
+                self.encoding = file.encoding
+
+    def reset(self, text):
+        # Pieces are (text, start, stop) slices, and starts are the offsets
+        # of the pieces in the edited text, for bisection.
+        self.pieces = [(text, 0, len(text))] if text else []
+        self.starts = [0] if text else []
+        # The pieces from the first index on start delta characters later
+        # than their offset in starts says: the offsets after an edit are
+        # only shifted when an edit further on needs them.
+        self.moved = 0, 0
+        self.length = len(text)
+        self.edited = False
+
+    def piece(self, pos):
+        '''Index of the piece holding pos.'''
+        first, delta = self.moved
+        i = bisect_right(self.starts, pos, 0, first)
+        if i == first:
+            i = bisect_right(self.starts, pos - delta, first)
+        return i - 1
+
+    def offset(self, i):
+        '''Offset of the piece at index i in the edited text.'''
+        first, delta = self.moved
+        return self.starts[i] + delta if i >= first else self.starts[i]
+
+    def settle(self, index):
+        '''Shift the offsets up to index, and no further.'''
+        first, delta = self.moved
+        starts = self.starts
+        if index > first:
+            starts[first:index] = [offset + delta
+                                   for offset in starts[first:index]]
+        elif index < first:
+            starts[index:first] = [offset - delta
+                                   for offset in starts[index:first]]
+        self.moved = index, delta
+
+    def split(self, pos):
+        '''Make a piece start at pos, and return the index of that piece.'''
+        i = self.piece(pos)
+        if i < 0:
+            return 0
+        text, start, stop = self.pieces[i]
+        cut = start + pos - self.offset(i)
+        if cut == start:
+            return i
+        elif cut >= stop:
+            return i + 1
+        self.pieces[i:i+1] = [(text, start, cut), (text, cut, stop)]
+        self.settle(i + 1)
+        self.starts.insert(i + 1, pos - self.moved[1])
+        return i + 1
+
+    def replace(self, start, stop, val=''):
+        '''Replace the characters between start and stop by val.'''
+        start = min(max(start, 0), self.length)
+        stop = min(max(stop, start), self.length)
+        i = self.split(start)
+        j = self.split(stop)
+        self.settle(j)
+        self.pieces[i:j] = [(val, 0, len(val))] if val else []
+        self.starts[i:j] = [start] if val else []
+        # The pieces after the edit move, but their offsets are left as
+        # they are until needed.
+        delta = len(val) - (stop - start)
+        self.moved = i + 1 if val else i, self.moved[1] + delta
+        self.length += delta
+        self.edited = True
+
+    def __getitem__(self, index):
+        if isinstance(index, int):
+            if index < 0:
+                index += self.length
+            self.seek(index)
+            return self.read(1)
+        elif isinstance(index, slice):
+            if index.step not in (1, None):
+                raise ValueError('step must be 1.')
+            start, stop, _ = index.indices(self.length)
+            self.seek(start)
+            return self.read(max(stop - start, 0))
+        else:
+            raise TypeError('index should be an int or slice.')
+
+    def __setitem__(self, index, val):
+        if not isinstance(val, str):
+            raise TypeError('val should be a string.')
+        if isinstance(index, int):
+            if index < 0:
+                index += self.length
+            self.replace(index, index + 1, val)
+        elif isinstance(index, slice):
+            if index.step not in (1, None):
+                raise ValueError('step must be 1.')
+            start, stop, _ = index.indices(self.length)
+            self.replace(start, stop, val)
+        else:
+            raise TypeError('index should be an int or slice.')
+
+    def __delitem__(self, index):
+        self[index] = ''
+
+    def insert(self, index, val):
+        self.replace(self.tell() + index, self.tell() + index, val)
+
+    def seek(self, pos, whence=0):
+        if whence == 1:
+            pos += self.pos
+        elif whence == 2:
+            pos += self.length
+        self.pos = pos
+
+    def __len__(self):
+        return self.length
+
+    def write(self, data):
+        data = str(data)
+        self.replace(self.pos, self.pos + len(data), data)
+        self.pos += len(data)
+
+    def writelines(self, data, sep=''):
+        self.write(sep.join(str(i) for i in data))
+
+    def read(self, size=-1):
+        stop = self.length if size < 0 else min(self.pos + size, self.length)
+        output = []
+        if self.pos < stop:
+            i = self.piece(self.pos)
+            offset = self.pos
+            while offset < stop:
+                text, start, end = self.pieces[i]
+                first = start + offset - self.offset(i)
+                last = min(end, first + stop - offset)
+                output.append(text[first:last])
+                offset += last - first
+                i += 1
+        self.pos = max(self.pos, stop)
+        return ''.join(output)
+
+    def readline(self, size=-1):
+        stop = self.length if size < 0 else min(self.pos + size, self.length)
+        output = []
+        while self.pos < stop:
+            i = self.piece(self.pos)
+            text, start, end = self.pieces[i]
+            first = start + self.pos - self.offset(i)
+            last = min(end, first + stop - self.pos)
+            line = text.find('\n', first, last)
+            if line != -1:
+                last = line + 1
+            output.append(text[first:last])
+            self.pos += last - first
+            if line != -1:
+                break
+        return ''.join(output)
+
+    def readlines(self, sizehint=-1):
+        output = []
+        while True:
+            line = self.readline()
+            if not line:
+                return output
+            output.append(line)
+            sizehint -= len(line)
+            if sizehint == 0:
+                return output
+
+    def truncate(self, size=None):
+        if size is None:
+            size = self.pos
+        self.replace(size, self.length)
+        return self.length
+
+    def commit(self):
+        '''Write the edited text to the file, in one pass.
+
+        The text is written to a new file next to it, which then takes its
+        place at once, so that the file is never left half written.'''
+        if not self.edited:
+            return
+        text = ''.join(text[start:stop] for text, start, stop in self.pieces)
+        with self.lock:
+            fd, temp = tempfile.mkstemp(dir=str(self.name.parent),
+                                        prefix=self.name.name + '.')
+            try:
+                with open(fd, 'w', encoding=self.encoding) as file:
+                    file.write(text)
+                    file.flush()
+                    os.fsync(file.fileno())
+                os.chmod(temp, stat.S_IMODE(os.stat(str(self.name)).st_mode))
+                os.replace(temp, str(self.name))
+            except BaseException:
+                os.remove(temp)
+                raise
+        self.reset(text)
+
+class MappedStream:
+    '''Read-only file, mapped in memory instead of being read into strings.
+
+    Positions are byte offsets, so that len() and seek() do not depend on
+    the size of the file. Only the parts that are read or sliced are
+    decoded, reading goes on where the last read stopped, even in the middle
+    of a character, and slicing leaves the position as it is.'''
+
+    def __init__(self, name, encoding='utf-8'):
+        self.name = pathlib.Path(name)
+        self.encoding = encoding
+        self.pos = 0
+        self.file = self.name.open('rb')
+        if os.fstat(self.file.fileno()).st_size:
+            self.map = mmap.mmap(self.file.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+        else:
+            # Empty files cannot be mapped.
+            self.map = b''
+        self.data = memoryview(self.map)
+        self.decoder = codecs.getincrementaldecoder(encoding)()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        char = self.read(1)
+        if char:
+            return char
+        else:
+            raise StopIteration
+
+    def __getitem__(self, index):
+        if isinstance(index, int):
+            # The character starting at that byte.
+            if index < 0:
+                index += len(self.data)
+            for end in range(index + 1, min(index + 4, len(self.data)) + 1):
+                try:
+                    return str(self.data[index:end], self.encoding)
+                except UnicodeDecodeError:
+                    pass
+            raise IndexError('No character starts at {}.'.format(index))
+        elif isinstance(index, slice):
+            if index.step not in (1, None):
+                raise ValueError('step must be 1.')
+            start, stop, _ = index.indices(len(self.data))
+            return str(self.data[start:stop], self.encoding)
+        else:
+            raise TypeError('index should be an int or slice.')
+
+    def __len__(self):
+        return len(self.data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, trace):
+        self.close()
+
+    def isatty(self):
+        return False
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        if not self.file.closed:
+            self.data.release()
+            if self.map:
+                self.map.close()
+            self.file.close()
+
+    def tell(self):
+        return self.pos
+
+    def seekable(self):
+        return True
+
+    def seek(self, pos, whence=0):
+        if whence == 1:
+            pos += self.pos
+        elif whence == 2:
+            pos += len(self.data)
+        self.pos = min(max(pos, 0), len(self.data))
+        self.decoder.reset()
+        return self.pos
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return False
+
+    def write(self, data):
+        raise io.UnsupportedOperation('The stream is read-only.')
+
+    def read(self, size=-1):
+        output = ''
+        while not output and self.pos < len(self.data):
+            end = len(self.data) if size < 0 else\
+                  min(self.pos + size, len(self.data))
+            output = self.decoder.decode(self.data[self.pos:end],
+                                         end == len(self.data))
+            self.pos = end
+        return output
+
+    def readline(self, size=-1):
+        end = self.map.find(b'\n', self.pos) + 1 if self.map else 0
+        if not end:
+            end = len(self.data)
+        if size >= 0:
+            end = min(end, self.pos + size)
+        return self.read(end - self.pos)
+
+    def readlines(self, sizehint=-1):
+        output = []
+        while True:
+            line = self.readline()
+            if not line:
+                return output
+            output.append(line)
+            sizehint -= len(line)
+            if sizehint == 0:
+                return output
+
 class Lock:
+    '''Advisory lock on a file, held by the kernel with flock().
+
+    Any number of shared locks can be held at once, for reading, but an
+    exclusive lock, for writing, is held alone. Waiting for a lock without
+    a timeout sleeps in the kernel until it is released. Locks held by a
+    process are released when it ends, so none are left behind.'''
+
+    def __init__(self, name=''):
+        self.name = pathlib.Path(name)
+        # Descriptor holding the lock, and the mode of each acquire() that
+        # was not released yet
+        self.fd, self.modes = None, []
+
+    @property
+    def count(self):
+        return len(self.modes)
+
+    def acquire(self, blocking=True, timeout=-1, shared=False):
+        '''Take the lock, shared or exclusive, and return whether it was
+        taken. Waiting stops after timeout seconds, if it is positive.
+
+        Taking it again while it is held is counted, and a shared lock is
+        upgraded to an exclusive one if need be, until it is released.'''
+        mode = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        if self.modes:
+            if mode == fcntl.LOCK_EX and fcntl.LOCK_EX not in self.modes and\
+               not self.take(self.fd, mode, blocking, timeout):
+                return False
+            self.modes.append(mode)
+            return True
+        # Only writers create the file: reading a missing one fails.
+        flags = os.O_RDONLY if shared else os.O_RDONLY | os.O_CREAT
+        fd = os.open(str(self.name), flags)
+        try:
+            if not self.take(fd, mode, blocking, timeout):
+                os.close(fd)
+                return False
+        except BaseException:
+            os.close(fd)
+            raise
+        self.fd, self.modes = fd, [mode]
+        return True
+
+    def take(self, fd, mode, blocking, timeout):
+        if blocking and timeout < 0:
+            fcntl.flock(fd, mode)
+            return True
+        return self.attempt(fd, mode, timeout if blocking else 0)
+
+    def attempt(self, fd, mode, timeout):
+        # flock() cannot time out, so it is tried again until the deadline,
+        # less and less often.
+        deadline = time.monotonic() + timeout
+        wait = 0.001
+        while True:
+            try:
+                fcntl.flock(fd, mode | fcntl.LOCK_NB)
+                return True
+            except BlockingIOError:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return False
+                time.sleep(min(wait, left))
+                wait = min(wait * 2, BACKOFF)
+
+    def release(self):
+        if not self.modes:
+            return False
+        mode = self.modes.pop()
+        if not self.modes:
+            fd, self.fd = self.fd, None
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+        elif mode == fcntl.LOCK_EX and fcntl.LOCK_EX not in self.modes:
+            # Back to the shared lock it was upgraded from.
+            fcntl.flock(self.fd, fcntl.LOCK_SH)
+        return True
+
+    @contextmanager
+    def shared(self, timeout=-1):
+        '''Hold a shared lock, for reading, in a with statement.'''
+        if not self.acquire(timeout=timeout, shared=True):
+            raise TimeoutError('{} is locked.'.format(self.name))
+        try:
+            yield self
+        finally:
+            self.release()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, exc_type, exc_value, trace):
+        self.release()
+        return not bool(exc_type)
+
+class LockFile:
+    '''Lock held by a .lock file next to the locked file, for systems
+    without fcntl. Waiting for it is done by polling, every delay seconds.'''
 
     def __init__(self, name=''):
         self.name = pathlib.Path(name)
         self.name = self.name.with_suffix('.lock')
 
-    def acquire(self, blocking=True, timeout=-1, delay=DELAY):
+    def acquire(self, blocking=True, timeout=-1, shared=False, delay=DELAY):
         timeleft = timeout // delay
         while self.name.exists():
             with self.name.open() as file:
@@ -228,6 +675,19 @@ class Lock:
         self.release()
         return not bool(exc_type)
 
+    @contextmanager
+    def shared(self, timeout=-1):
+        # Lock files are never shared.
+        if not self.acquire(timeout=timeout):
+            raise TimeoutError('{} is locked.'.format(self.name))
+        try:
+            yield self
+        finally:
+            self.release()
+
+if fcntl is None:
+    Lock = LockFile
+
 if __name__ == '__main__':
     print('########################')
     print('# Trying out a stream! #')
@@ -0,0 +1,286 @@
+import re, codecs, sys
+sys.path.append('../..')
+
+from Cassiopee.parsing.exceptions import NeedData
+
+# Number of characters pulled from the source on every refill.
+CHUNK = 1 << 16
+
+# == Precompiled character classes used by the parser ==
+# Anything that ends a run of character data.
+TEXT_END = re.compile('[<&]')
+# Anything that ends an element or attribute name.
+NAME_END = re.compile(r'[\s/>=]')
+# Anything that ends a processing instruction name or attribute name.
+PI_END = re.compile(r'[\s=?]')
+# Anything that ends a declaration keyword.
+DECL_END = re.compile(r'[\s\[>%]')
+# Anything that ends a word inside a declaration.
+WORD_END = re.compile(r'[\s"\'%>]')
+# Anything that ends a name in a content model.
+MODEL_END = re.compile(r'[\s()|,+?*%>]')
+# Markup that matters inside a generic declaration or a DTD.
+DECL_MARK = re.compile(r'[\[>%]')
+DTD_MARK = re.compile(r'[\]%<]')
+# Quotes around attribute values and literals.
+QUOTE = re.compile('["\']')
+# Anything that ends a run of characters in a quoted literal.
+STRING_END = {'"': re.compile('["&]'), '\'': re.compile('[\'&]')}
+# Anything that is not white space.
+NOT_SPACE = re.compile(r'\S')
+# The rest of a whole start tag, when its attribute values hold no entity
+# reference: name, attributes and whether the element is closed at once.
+START_TAG = re.compile(r'([^\s/>=]*)((?:\s+[^\s/>=]+\s*=\s*'
+                       r'(?:"[^"&<]*"|\'[^\'&<]*\'))*)\s*(/?)>')
+# A single attribute in the attributes of a START_TAG match.
+ATTRIBUTE = re.compile(r'([^\s=]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\')')
+# Longest tag matched at once; longer tags go through the slow path.
+LOOKAHEAD = 1 << 12
+
+class Scanner:
+    '''Buffered reader for the parser, scanning whole runs of characters.
+
+    The source only needs a read(size) method returning strings or bytes,
+    like a Stream or an open file. Without a source, the data is pushed with
+    feed() instead, and running out of it raises NeedData until close().
+
+    Replacement text, like the value of an entity, is read through push():
+    it is stacked over the buffer and read before what follows it, without
+    changing the source.'''
+
+    def __init__(self, source=None, chunk=CHUNK, encoding='utf-8'):
+        self.source = source
+        self.chunk = chunk
+        # Absolute position of the first character of the source buffer.
+        self.offset = 0
+        # Byte offset of that character, and the last position converted to
+        # a byte offset in the source buffer, with that offset.
+        self.bytes, self.known = 0, (0, 0)
+        self.encoding = encoding
+        self.buffer, self.pos = '', 0
+        # Buffers and positions suspended by pushed text, the source first.
+        self.stack = []
+        self.eof = False
+        # Fed data not copied to the buffer yet, and whether it is held back
+        # because the scanner ran out of data in the middle of a token.
+        self.fed, self.waiting = [], False
+        self.decoder = codecs.getincrementaldecoder(encoding)()
+
+    def feed(self, data):
+        '''Append more data to the source, as a string or as encoded
+        bytes.
+
+        While the scanner waits for the end of a token, fed data is only
+        copied to the buffer once some of it holds a '>' or a ';', that
+        could end the token.'''
+        if isinstance(data, bytes):
+            data = self.decoder.decode(data)
+        self.fed.append(data)
+        if '>' in data or ';' in data:
+            self.waiting = False
+        if not self.waiting:
+            self.flush()
+
+    def flush(self):
+        '''Copy the fed data after the rest of the buffer.'''
+        data = ''.join(self.fed)
+        self.fed = []
+        if self.stack:
+            buffer, pos = self.stack[0]
+            self.offset += pos
+            self.stack[0] = buffer[pos:] + data, 0
+        else:
+            self.offset += self.pos
+            self.buffer = self.buffer[self.pos:] + data
+            self.pos = 0
+
+    def close(self):
+        '''Mark the end of the fed data.'''
+        self.waiting = False
+        self.feed(self.decoder.decode(b'', True))
+        self.eof = True
+
+    def wait(self):
+        '''Hold fed data back when the scanner ran out of it in the middle
+        of a token, until some of it could end the token.'''
+        self.waiting = self.pos < len(self.buffer) or\
+                       any(pos < len(buffer) for buffer, pos in self.stack)
+
+    def push(self, text):
+        '''Read text before the rest of the input.'''
+        self.stack.append((self.buffer, self.pos))
+        self.buffer, self.pos = text, 0
+
+    def fill(self):
+        '''Read one more chunk, dropping what was already consumed.'''
+        if self.stack:
+            # The pushed text is over, back to what it was pushed over.
+            rest = self.buffer[self.pos:]
+            self.buffer, self.pos = self.stack.pop()
+            if rest:
+                if not self.stack:
+                    self.offset += self.pos - len(rest)
+                self.buffer = rest + self.buffer[self.pos:]
+                self.pos = 0
+            return True
+        elif self.eof:
+            return False
+        elif self.source is None:
+            raise NeedData('The fed data is exhausted.')
+        data = self.source.read(self.chunk)
+        if isinstance(data, bytes):
+            data = self.decoder.decode(data, not data)
+        if not data:
+            self.eof = True
+            return False
+        self.bytes = self.position()
+        self.known = 0, self.bytes
+        self.offset += self.pos
+        self.buffer = self.buffer[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while self.pos >= len(self.buffer):
+            if not self.fill():
+                raise StopIteration
+        char = self.buffer[self.pos]
+        self.pos += 1
+        return char
+
+    def peek(self):
+        '''Return the next character without consuming it.'''
+        while self.pos >= len(self.buffer):
+            if not self.fill():
+                return ''
+        return self.buffer[self.pos]
+
+    def until(self, pattern, partial=False):
+        '''Consume and return everything before the first match of pattern.
+
+        The pattern must match single characters, so that a match is never
+        split between two chunks. At the end of the source, the rest of the
+        input is returned. If partial, so is the rest of the fed data when it
+        runs out, unless there is none.'''
+        match = pattern.search(self.buffer, self.pos)
+        if match:
+            data = self.buffer[self.pos:match.start()]
+            self.pos = match.start()
+            return data
+        data = []
+        while True:
+            data.append(self.buffer[self.pos:])
+            self.pos = len(self.buffer)
+            try:
+                if not self.fill():
+                    return ''.join(data)
+            except NeedData:
+                if partial and any(data):
+                    return ''.join(data)
+                raise
+            match = pattern.search(self.buffer, self.pos)
+            if match:
+                data.append(self.buffer[self.pos:match.start()])
+                self.pos = match.start()
+                return ''.join(data)
+
+    def upto(self, literal):
+        '''Consume everything up to and including literal, and return
+        what came before it.'''
+        start = self.pos
+        while True:
+            end = self.buffer.find(literal, start)
+            if end != -1:
+                data = self.buffer[self.pos:end]
+                self.pos = end + len(literal)
+                return data
+            start = max(len(self.buffer) - self.pos - len(literal) + 1, 0)
+            if not self.fill():
+                data = self.buffer[self.pos:]
+                self.pos = len(self.buffer)
+                return data
+            # Back from pushed text, the buffer is read from where it was.
+            start = max(start, self.pos)
+
+    def search(self, pattern, size=LOOKAHEAD):
+        '''Move to the first match of pattern, and return it without
+        consuming it, or None at the end of the source.
+
+        Matches must be shorter than size, so that a match split between two
+        chunks is found again once both are read.'''
+        while True:
+            match = pattern.search(self.buffer, self.pos)
+            if match and (match.end() < len(self.buffer) or self.eof):
+                self.pos = match.start()
+                return match
+            self.pos = max(len(self.buffer) - size, self.pos)
+            if not self.fill():
+                self.pos = len(self.buffer)
+                return None
+
+    def match(self, pattern):
+        '''Consume and return a match of pattern at the current position.
+
+        Only the next LOOKAHEAD characters are guaranteed to be buffered, so
+        a match running up to the end of the buffer is not trusted, and None
+        is returned as when nothing matches.'''
+        if len(self.buffer) - self.pos < LOOKAHEAD and not self.stack:
+            try:
+                self.fill()
+            except NeedData:
+                pass
+        match = pattern.match(self.buffer, self.pos)
+        if match and (match.end() < len(self.buffer) or self.eof):
+            self.pos = match.end()
+            return match
+        return None
+
+    def skip(self, pattern=NOT_SPACE):
+        '''Move past everything before the first match of pattern, and
+        return the matching character, without consuming it.'''
+        self.until(pattern)
+        return self.peek()
+
+    def mark(self):
+        '''Save the reading state, pushed text included, for reset().'''
+        return self.buffer, self.pos, self.offset, self.stack[:]
+
+    def reset(self, mark):
+        '''Go back to a state saved by mark(), as long as the source was
+        not read any further since.'''
+        self.buffer, self.pos, self.offset, self.stack = mark
+        self.stack = self.stack[:]
+
+    def position(self):
+        '''Byte offset in the source of the next character, leaving pushed
+        text out. Only sources giving bytes are tracked.'''
+        buffer, pos = self.stack[0] if self.stack else (self.buffer, self.pos)
+        start, offset = self.known
+        if pos < start:
+            start, offset = 0, self.bytes
+        offset += len(buffer[start:pos].encode(self.encoding))
+        self.known = pos, offset
+        return offset
+
+    def tell(self):
+        '''Position in the source, leaving pushed text out.'''
+        if self.stack:
+            return self.offset + self.stack[0][1]
+        return self.offset + self.pos
+
+    def seek(self, pos):
+        '''Move to an absolute position in the source, dropping any pushed
+        text and rereading the source from there.'''
+        if self.stack:
+            self.buffer, self.pos = self.stack[0]
+            self.stack = []
+        if hasattr(self.source, 'seek'):
+            self.source.seek(pos)
+            self.offset, self.buffer, self.pos = pos, '', 0
+            self.bytes, self.known = pos, (0, pos)
+            self.eof = False
+        else:
+            self.pos = pos - self.offset
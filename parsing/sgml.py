@@ -7,6 +7,8 @@ from Cassiopee.parsing.base import *
 # == Entity References                                                    ==
 class SGML(Node):
 
+    __slots__ = ('value',)
+
     def __init__(self, name, content=''):
         self.name = name
         self.value = content
@@ -19,10 +21,13 @@ class SGML(Node):
 
 class DocumentType(SGML):
 
+    __slots__ = ('root', 'location')
+
     def __init__(self, root, location=[], content=[]):
         self.name = 'DOCTYPE'
         self.root = root
-        self.location = location
+        # Copied, so that document types do not share their locations.
+        self.location = location[:]
         self[:] = content[:]
 
     def __repr__(self):
@@ -31,8 +36,13 @@ class DocumentType(SGML):
 
     def __str__(self):
         addr_type = 'PUBLIC' if len(self.location) == 2 else 'SYSTEM'
-        location = '"{}"'.format(self.location[-1]) if addr_type == 'SYSTEM'\
-                   else '"{}" "{}"'.format(*self.location)
+        if not self.location:
+            # Only inline definitions.
+            addr_type = location = ''
+        elif addr_type == 'SYSTEM':
+            location = '"{}"'.format(self.location[-1])
+        else:
+            location = '"{}" "{}"'.format(*self.location)
         mask = lambda x: isinstance(x, SGML)
         content = '[\n{}\n]'.format('\n'.join(
                     str(i) for i in self.filter(mask)))
@@ -48,6 +58,8 @@ class DocumentType(SGML):
 
 class ContentRef(Node):
 
+    __slots__ = ('min', 'max')
+
     def __init__(self, first=None, minoccur=1, maxoccur=1):
         super().__init__()
         self.min, self.max = minoccur, maxoccur
@@ -89,6 +101,8 @@ class ContentRef(Node):
 
 class Choice(ContentRef):
 
+    __slots__ = ()
+
     def end(self):
         kids = set()
         for ref in self:
@@ -120,6 +134,8 @@ class Choice(ContentRef):
 
 class Sequence(ContentRef):
 
+    __slots__ = ()
+
     def end(self):
         last = set()
         for bit in self[-1::-1]:
@@ -192,12 +208,18 @@ counters = {(0, 1):'?', (1, 1): '', (0, Inf()):'*', (1, Inf()):'+'}
 
 class ElementType(SGML):
 
+    __slots__ = ('content', 'attrs', 'defaults')
+
     def __init__(self, name, content=Sequence(), attrs={}):
         self.name = name
         self.content = content
         # Make a shallow copy, because otherwise all element types will refer
         # to the same attribute list.
         self.attrs = attrs.copy()
+        # Defaults of the attributes, by name, as (keyword, value): the
+        # keyword is #REQUIRED, #IMPLIED, #FIXED or empty, and the value
+        # the quoted default, if any
+        self.defaults = {}
 
     def __repr__(self):
         return '<Element Definition for ' + repr(self.name) +\
@@ -218,12 +240,23 @@ class ElementType(SGML):
         if self.attrs:
             output += '\n<!ATTLIST {} {}>'.format(self.name,
                                     '\n\t'.join(str(attr) + ' ' +\
-                                    str(self.attrs[attr])\
+                                    str(self.attrs[attr]) +\
+                                    self.default(attr)\
                                     for attr in self.attrs))
         return output
 
+    def default(self, attr):
+        '''Default of an attribute, as it is declared.'''
+        keyword, value = self.defaults.get(attr, ('', None))
+        output = ' ' + keyword if keyword else ''
+        if value is not None:
+            output += ' "{}"'.format(value.escape())
+        return output
+
 class EntityDefinition(SGML):
 
+    __slots__ = ('system',)
+
     def __init__(self, name, value, system=False):
         self.name = name
         self.value = value
@@ -239,6 +272,8 @@ class EntityDefinition(SGML):
 
 class MarkupComment(SGML):
 
+    __slots__ = ('content',)
+
     def __init__(self, content):
         self.content = content
 
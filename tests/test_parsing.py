@@ -0,0 +1,174 @@
+import sys, unittest
+sys.path.append('../..')
+
+from Cassiopee.parsing import *
+
+class EditTest(unittest.TestCase):
+    '''Edits of documents keeping their source, through Parser.edit().'''
+
+    def setUp(self):
+        self.parser = Parser()
+        self.document = Document('', self.parser)
+        self.parser.reparse(self.document,
+                            '<r>\n <a>t</a>\n <b>u</b>\n</r>')
+
+    def test_broken_tag(self):
+        # Deleting the '<' of <a> leaves an end tag matching no open element.
+        self.parser.edit(self.document, self.document.source.index('<a>'), 1)
+        self.assertEqual(self.document.source, '<r>\n a>t</a>\n <b>u</b>\n</r>')
+        root, = [node for node in self.document if isinstance(node, Element)]
+        self.assertEqual(root.name, 'r')
+        self.assertEqual([str(kid.name) for kid in root
+                          if isinstance(kid, Element)], ['b'])
+
+    def test_failed_edit(self):
+        # A source that cannot be parsed leaves the document as it was.
+        before = str(self.document)
+        with self.assertRaises(Exception):
+            self.parser.edit(self.document, 0, 0, '<!DOCTYPE r SYSTEM "none">')
+        self.assertEqual(str(self.document), before)
+        self.assertEqual(self.document.source,
+                         '<r>\n <a>t</a>\n <b>u</b>\n</r>')
+
+class IndexTest(unittest.TestCase):
+    '''Queries by name and ID, with and without the indexes of
+    Document.indexelements().'''
+
+    source = '<r xmlns:x="u"><a id="1"/><x:a id="2"><a id="3"/></x:a>'\
+             '<b><x:a id="4"/></b></r>'
+
+    def setUp(self):
+        self.parser = Parser()
+        self.plain = Document('', self.parser)
+        self.parser.reparse(self.plain, self.source)
+        self.document = Document('', self.parser)
+        self.parser.reparse(self.document, self.source)
+        self.document.indexelements()
+        self.root, = [node for node in self.document
+                      if isinstance(node, Element)]
+
+    def ids(self, nodes):
+        return [str(node.get('id')) for node in nodes]
+
+    def test_names(self):
+        # A local name stands for that name in any namespace.
+        for name in ['a', 'x:a', 'b', self.parser.names('x:a')]:
+            self.assertEqual(self.ids(self.document[name]),
+                             self.ids(self.plain[name]))
+        self.assertEqual(self.ids(self.document['a']), ['1', '2', '3', '4'])
+        self.assertEqual(self.ids(self.document['x:a']), ['2', '4'])
+
+    def test_changes(self):
+        new = Element(self.parser.names('a'))
+        new.set('id', '0')
+        self.root.insert(0, new)
+        self.assertEqual(self.ids(self.document['a']),
+                         ['0', '1', '2', '3', '4'])
+        self.root.remove(new)
+        self.assertIsNone(self.document.get_by_id('0'))
+        b, = self.document['b']
+        b.extend([Text('t'), new])
+        self.assertIs(self.document['a'][-1], new)
+        b.pop()
+        self.assertEqual(self.ids(self.document['a']), ['1', '2', '3', '4'])
+        first = self.document.get_by_id('1')
+        first.addattr(Attribute(self.parser.names('id'), Text('z')))
+        self.assertIsNone(self.document.get_by_id('1'))
+        self.assertIs(self.document.get_by_id('z'), first)
+
+class LightTest(unittest.TestCase):
+    '''Events of the streaming SGMLParser.'''
+
+    def events(self, source):
+        import io
+        from Cassiopee.parsing.light import SGMLParser
+        from Cassiopee.parsing.scanner import Scanner
+        self.parser = SGMLParser()
+        return list(self.parser.parse(Scanner(io.StringIO(source))))
+
+    def test_entities(self):
+        # Literals may hold markup, and values hold references.
+        events = self.events('<!DOCTYPE r [<!ENTITY c "x > [y]">'
+                             '<!ENTITY a "A&amp;B&#67;&c;">]><r>&a;</r>')
+        self.assertEqual(self.parser.entities,
+                         {'c': 'x > [y]', 'a': 'A&BCx > [y]'})
+        self.assertIn(('text', None, 'A&BCx > [y]'), events)
+
+class EditableStreamTest(unittest.TestCase):
+    '''Edits of an EditableStream, against the same edits of a string.'''
+
+    def test_edits(self):
+        import os, random, tempfile
+        from Cassiopee.parsing.pipes import EditableStream
+        text = '0123456789\n' * 50
+        with tempfile.TemporaryDirectory() as folder:
+            name = os.path.join(folder, 'text')
+            with open(name, 'w') as file:
+                file.write(text)
+            stream = EditableStream(name)
+            edits = random.Random(0)
+            for i in range(500):
+                start = edits.randrange(len(text) + 1)
+                stop = min(start + edits.choice([0, 1, 4]), len(text))
+                value = edits.choice(['', 'x', 'yz'])
+                stream.replace(start, stop, value)
+                text = text[:start] + value + text[stop:]
+                start = edits.randrange(len(text) + 1)
+                stream.seek(start)
+                self.assertEqual(stream.read(7), text[start:start+7])
+            self.assertEqual(stream[0:len(stream)], text)
+            stream.commit()
+            with open(name) as file:
+                self.assertEqual(file.read(), text)
+            self.assertEqual(os.listdir(folder), ['text'])
+
+class ExpatTest(unittest.TestCase):
+    '''Documents read by the expat backend, against the parser's own.'''
+
+    source = '<!DOCTYPE r [<!ELEMENT r (a|b)*><!ELEMENT a (#PCDATA)>'\
+             '<!ELEMENT b EMPTY>]>\n<r>\n <a> t </a>\n <b/>\n</r>'
+
+    def load(self, backend, **options):
+        parser = Parser(backend=backend)
+        document = Document('', parser)
+        for option, value in options.items():
+            setattr(document, option, value)
+        builder = parser.builder(parser, document)
+        builder.feed(self.source.encode())
+        builder.close()
+        root, = [node for node in document if isinstance(node, Element)]
+        return root
+
+    def test_strip(self):
+        # White space is only ignorable in elements without #PCDATA.
+        for backend in ('python', 'expat'):
+            root = self.load(backend, strip=True)
+            self.assertEqual([str(kid.name) for kid in root], ['a', 'b'])
+            self.assertEqual(root[0][0].data, ' t ')
+
+    def test_entities(self):
+        self.source = '<!DOCTYPE r [<!ENTITY a "x &amp; y">'\
+                      '<!ENTITY b "&a;!">]><r/>'
+        for backend in ('python', 'expat'):
+            document = self.load(backend).parent
+            self.assertEqual(document.entities['a'].value.data, 'x & y')
+            self.assertEqual(document.entities['b'].value.data, 'x & y!')
+
+class LazyTest(unittest.TestCase):
+    '''Elements whose content is only parsed when it is first accessed.'''
+
+    def test_children(self):
+        import os, tempfile
+        with tempfile.TemporaryDirectory() as folder:
+            name = os.path.join(folder, 'lazy.xml')
+            with open(name, 'w') as file:
+                file.write('<r><e><a/>t<b/></e></r>')
+            document = Parser().load(name, lazy=2)
+            root, = document.children()
+            element, = list.__iter__(root)
+            self.assertIsInstance(element, LazyElement)
+            self.assertEqual([str(kid.name) for kid in element.children()],
+                             ['a', 'b'])
+
+if __name__ == '__main__':
+    unittest.main()